@@ -0,0 +1,885 @@
+import os
+import hashlib
+import io
+import itertools
+import json
+import re
+import shutil
+import sqlite3
+import struct
+import tempfile
+import time
+import zipfile
+
+
+# Nomes possíveis do banco de dados da coleção dentro do .apkg, em ordem de
+# preferência (exports novos do Anki guardam os dados reais em .anki21)
+MEMBROS_COLECAO = ('collection.anki21', 'collection.anki2')
+
+# Coleções até este tamanho são lidas direto para a memória
+COLECAO_MAX_MEMORIA = 64 * 1024 * 1024
+
+# Tamanho máximo de um .apkg montado em memória antes de ir para um arquivo temporário
+APKG_MAX_MEMORIA = 32 * 1024 * 1024
+
+# Tamanho dos blocos na cópia direta de membros entre zips
+TAMANHO_BLOCO = 1024 * 1024
+
+# Baralhos até este tamanho recebem o anexo em uma cópia, que só substitui o original
+# depois de conferida; acima disso o anexo é feito no próprio arquivo
+APKG_ANEXAR_COPIA_MAX = 256 * 1024 * 1024
+
+# Espaço morto (bytes de membros substituídos) tolerado antes de compactar o .apkg
+ESPACO_MORTO_MINIMO = 16 * 1024 * 1024
+ESPACO_MORTO_PROPORCAO = 0.5
+
+# Versão do esquema do índice; índices de outra versão são reconstruídos
+VERSAO_INDICE = 2
+
+# Quantidade de chaves por consulta ao índice
+TAMANHO_LOTE_CONSULTA = 500
+
+
+def normalizar_chave(word, context):
+    """
+    Gera a chave word|context usada para detectar cartas duplicadas.
+
+    Args:
+        word: Texto da palavra
+        context: Texto do contexto
+
+    Returns:
+        String no formato word|context em lowercase
+    """
+    return f"{word.strip().lower()}|{context.strip().lower()}"
+
+
+def hash_chave(chave):
+    """
+    Digest de 64 bits de uma chave word|context, usado no índice do baralho.
+
+    Args:
+        chave: Chave gerada por normalizar_chave
+
+    Returns:
+        Inteiro com sinal de 64 bits (cabe em um INTEGER do SQLite)
+    """
+    digest = hashlib.blake2b(chave.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class LeitorApkg:
+    """
+    Leitor de um arquivo .apkg que abre o zip uma única vez.
+
+    Só o banco de dados da coleção é lido (para a memória ou para um único
+    arquivo temporário); os arquivos de mídia são apenas listados a partir
+    do mapa 'media', sem extração.
+
+    Uso:
+        with LeitorApkg(apkg_path) as leitor:
+            chaves = leitor.chaves_cartas()
+            midias = leitor.membros_midia()
+    """
+
+    def __init__(self, apkg_path, modo='r'):
+        """
+        Args:
+            apkg_path: Caminho do arquivo .apkg
+            modo: 'r' para leitura ou 'a' para também anexar membros
+        """
+        self.apkg_path = apkg_path
+        self.zip = zipfile.ZipFile(apkg_path, modo)
+        self._conn = None
+        self._db_temp = None
+        self._mapa_midia = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.fechar()
+
+    def fechar(self):
+        """Fecha o zip, a conexão com a coleção e remove o arquivo temporário."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._db_temp and os.path.exists(self._db_temp):
+            os.remove(self._db_temp)
+            self._db_temp = None
+        self.zip.close()
+
+    def membro_colecao(self):
+        """
+        Returns:
+            ZipInfo do banco de dados da coleção, ou None se não existir
+        """
+        nomes = set(self.zip.namelist())
+        for nome in MEMBROS_COLECAO:
+            if nome in nomes:
+                return self.zip.getinfo(nome)
+        return None
+
+    def colecao(self):
+        """
+        Abre (uma vez) o banco de dados SQLite da coleção.
+
+        Returns:
+            sqlite3.Connection, ou None se o .apkg não tiver coleção
+        """
+        if self._conn is not None:
+            return self._conn
+
+        info = self.membro_colecao()
+        if info is None:
+            return None
+
+        if info.file_size <= COLECAO_MAX_MEMORIA and hasattr(sqlite3.Connection, 'deserialize'):
+            conn = sqlite3.connect(':memory:')
+            conn.deserialize(self.zip.read(info))
+        else:
+            fd, self._db_temp = tempfile.mkstemp(suffix='.anki2')
+            os.close(fd)
+            self.copiar_colecao(self._db_temp)
+            conn = sqlite3.connect(self._db_temp)
+
+        self._conn = conn
+        return conn
+
+    def copiar_colecao(self, destino):
+        """
+        Grava o banco de dados da coleção em um arquivo, para ser modificado.
+
+        Args:
+            destino: Caminho do arquivo de saída
+
+        Returns:
+            Nome do membro da coleção no zip
+        """
+        info = self.membro_colecao()
+        if info is None:
+            raise zipfile.BadZipFile(f"{self.apkg_path} não contém uma coleção do Anki")
+        with self.zip.open(info) as origem, open(destino, 'wb') as arquivo:
+            shutil.copyfileobj(origem, arquivo)
+        return info.filename
+
+    def chaves_cartas(self):
+        """
+        Returns:
+            Set com chaves das cartas (word|context em lowercase)
+        """
+        return {chave for chave, _ in self.notas()}
+
+    def notas(self):
+        """
+        Percorre as notas da coleção sem carregá-las todas na memória.
+
+        Yields:
+            Tuplas (chave word|context, guid da nota)
+        """
+        conn = self.colecao()
+        if conn is None:
+            return
+
+        # O campo 'flds' contém os campos separados por \x1f. O contexto é o
+        # 4º campo (Word, Translation, Phonetic, Context), o 3º em baralhos sem
+        # Translation e o 2º nos baralhos antigos (Word, Context)
+        for flds, guid in conn.execute("SELECT flds, guid FROM notes"):
+            fields = flds.split('\x1f', 4)
+            if len(fields) >= 2:
+                yield normalizar_chave(fields[0], fields[min(len(fields), 4) - 1]), guid
+
+    def mapa_midia(self):
+        """
+        Returns:
+            Dict {nome do membro no zip: nome do arquivo de mídia}
+        """
+        if self._mapa_midia is None:
+            try:
+                self._mapa_midia = json.loads(self.zip.read('media').decode('utf-8'))
+            except KeyError:
+                self._mapa_midia = {}
+        return self._mapa_midia
+
+    def membros_midia(self):
+        """
+        Lista os arquivos de mídia do pacote sem extraí-los.
+
+        Returns:
+            Lista de tuplas (ZipInfo, nome do arquivo de mídia)
+        """
+        membros = []
+        for membro, nome in self.mapa_midia().items():
+            try:
+                membros.append((self.zip.getinfo(membro), nome))
+            except KeyError:
+                continue
+        return membros
+
+    def extrair_midias(self, destino):
+        """
+        Extrai só os arquivos de mídia, já com seus nomes reais.
+
+        Args:
+            destino: Pasta onde os arquivos serão gravados
+
+        Returns:
+            Lista com caminhos dos arquivos extraídos
+        """
+        os.makedirs(destino, exist_ok=True)
+        caminhos = []
+        for info, nome in self.membros_midia():
+            path = os.path.join(destino, os.path.basename(nome))
+            with self.zip.open(info) as origem, open(path, 'wb') as arquivo:
+                shutil.copyfileobj(origem, arquivo)
+            caminhos.append(path)
+        return caminhos
+
+
+def caminho_indice(apkg_path):
+    """Caminho do índice (sidecar SQLite) de um .apkg."""
+    return f"{apkg_path}.idx"
+
+
+def hash_arquivo(path):
+    """
+    Returns:
+        Hash sha256 (hexadecimal) do conteúdo do arquivo
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+class IndiceBaralho:
+    """
+    Índice persistente de um .apkg, gravado ao lado dele ({deck}.apkg.idx).
+
+    Guarda um digest de 64 bits das chaves normalizadas das notas (com o
+    guid) e o hash do conteúdo de cada mídia, para que a detecção de duplicatas e a busca de mídias sejam
+    consultas indexadas em vez de uma varredura do baralho inteiro. O índice
+    guarda o mtime e o tamanho do .apkg; se o arquivo mudar por fora, o índice
+    é reconstruído a partir dele na próxima abertura.
+    """
+
+    def __init__(self, apkg_path, validar=True):
+        """
+        Args:
+            apkg_path: Caminho do arquivo .apkg
+            validar: Se True, reconstrói o índice quando ele não confere com o .apkg
+        """
+        self.apkg_path = apkg_path
+        self.path = caminho_indice(apkg_path)
+        self.conn = sqlite3.connect(self.path)
+        self._criar_tabelas()
+        if validar and not self.valido():
+            self.reconstruir()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.fechar()
+
+    def fechar(self):
+        self.conn.close()
+
+    def _criar_tabelas(self):
+        # Índices de outra versão do esquema são descartados e reconstruídos
+        (versao,) = self.conn.execute("PRAGMA user_version").fetchone()
+        if versao != VERSAO_INDICE:
+            self.conn.executescript("""
+                DROP TABLE IF EXISTS meta;
+                DROP TABLE IF EXISTS notas;
+                DROP TABLE IF EXISTS midias;
+            """)
+            self.conn.execute(f"PRAGMA user_version = {VERSAO_INDICE}")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT);
+            CREATE TABLE IF NOT EXISTS notas (hash INTEGER PRIMARY KEY, guid TEXT);
+            CREATE TABLE IF NOT EXISTS midias (nome TEXT PRIMARY KEY, hash TEXT);
+        """)
+
+    def _assinatura(self):
+        """Assinatura (versão, mtime, tamanho) do .apkg atual."""
+        stat = os.stat(self.apkg_path)
+        return f"{VERSAO_INDICE}:{stat.st_mtime_ns}:{stat.st_size}"
+
+    def valido(self):
+        """Indica se o índice corresponde ao .apkg atual."""
+        if not os.path.exists(self.apkg_path):
+            return False
+        linha = self.conn.execute("SELECT valor FROM meta WHERE chave = 'assinatura'").fetchone()
+        return linha is not None and linha[0] == self._assinatura()
+
+    def limpar(self):
+        """Remove todas as entradas do índice."""
+        self.conn.execute("DELETE FROM meta")
+        self.conn.execute("DELETE FROM notas")
+        self.conn.execute("DELETE FROM midias")
+
+    def reconstruir(self):
+        """Recria o índice lendo o .apkg (notas e conteúdo das mídias)."""
+        self.limpar()
+        if os.path.exists(self.apkg_path):
+            with LeitorApkg(self.apkg_path) as leitor:
+                self.registrar_notas(leitor.notas())
+                midias = []
+                for info, nome in leitor.membros_midia():
+                    h = hashlib.sha256()
+                    with leitor.zip.open(info) as origem:
+                        for bloco in iter(lambda: origem.read(TAMANHO_BLOCO), b''):
+                            h.update(bloco)
+                    midias.append((nome, h.hexdigest()))
+                self.registrar_midias(midias)
+            self.carimbar()
+
+    def carimbar(self):
+        """Grava a assinatura do .apkg atual e confirma as alterações."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (chave, valor) VALUES ('assinatura', ?)",
+            (self._assinatura(),)
+        )
+        self.conn.commit()
+
+    def registrar_notas(self, notas):
+        """
+        Args:
+            notas: Iterável de tuplas (chave word|context, guid); é consumido sob demanda
+        """
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO notas (hash, guid) VALUES (?, ?)",
+            ((hash_chave(chave), guid) for chave, guid in notas)
+        )
+
+    def renomear_notas(self, pares):
+        """
+        Troca a chave de notas cujo conteúdo foi editado (o guid continua o mesmo).
+
+        Args:
+            pares: Iterável de tuplas (chave antiga, chave nova)
+        """
+        self.conn.executemany(
+            "UPDATE OR REPLACE notas SET hash = ? WHERE hash = ?",
+            ((hash_chave(nova), hash_chave(antiga)) for antiga, nova in pares)
+        )
+
+    def registrar_midias(self, midias):
+        """
+        Args:
+            midias: Iterável de tuplas (nome do arquivo, hash do conteúdo)
+        """
+        self.conn.executemany("INSERT OR REPLACE INTO midias (nome, hash) VALUES (?, ?)", midias)
+
+    def existentes(self, chaves):
+        """
+        Args:
+            chaves: Iterável de chaves word|context
+
+        Returns:
+            Set com as chaves que já existem no baralho
+        """
+        return set(self.guids(chaves))
+
+    def guids(self, chaves):
+        """
+        Busca as chaves no índice, em lotes, pelo digest de 64 bits.
+
+        Args:
+            chaves: Iterável de chaves word|context
+
+        Returns:
+            Dict {chave: guid da nota} para as chaves que existem no baralho
+        """
+        por_hash = {hash_chave(chave): chave for chave in chaves}
+        hashes = list(por_hash)
+        resultado = {}
+        for inicio in range(0, len(hashes), TAMANHO_LOTE_CONSULTA):
+            lote = hashes[inicio:inicio + TAMANHO_LOTE_CONSULTA]
+            marcadores = ','.join('?' * len(lote))
+            for h, guid in self.conn.execute(f"SELECT hash, guid FROM notas WHERE hash IN ({marcadores})", lote):
+                resultado[por_hash[h]] = guid
+        return resultado
+
+    def total_notas(self):
+        """Número de chaves distintas no baralho."""
+        return self.conn.execute("SELECT COUNT(*) FROM notas").fetchone()[0]
+
+    def midias_existentes(self, nomes):
+        """
+        Args:
+            nomes: Iterável de nomes de arquivos de mídia
+
+        Returns:
+            Set com os nomes que já existem no baralho
+        """
+        nomes = list(set(nomes))
+        encontrados = set()
+        for inicio in range(0, len(nomes), TAMANHO_LOTE_CONSULTA):
+            lote = nomes[inicio:inicio + TAMANHO_LOTE_CONSULTA]
+            marcadores = ','.join('?' * len(lote))
+            encontrados.update(
+                nome for (nome,) in
+                self.conn.execute(f"SELECT nome FROM midias WHERE nome IN ({marcadores})", lote)
+            )
+        return encontrados
+
+
+def escrever_apkg(package, output_path, leitor=None, timestamp=None, atualizacoes=()):
+    """
+    Grava um genanki.Package em disco, como Package.write_to_file, mas
+    reaproveitando as mídias de um .apkg existente.
+
+    Com um leitor, as notas do pacote são acrescentadas à coleção do baralho
+    existente, e as mídias antigas são copiadas membro a membro, direto do
+    zip antigo para o novo (sem descompactar, recompactar ou criar arquivos
+    temporários); só as mídias novas (package.media_files) são lidas do disco.
+    Se uma mídia nova tem o mesmo nome de uma antiga, a nova prevalece.
+
+    Args:
+        package: genanki.Package com o baralho e as mídias novas
+        output_path: Caminho do arquivo .apkg de saída (pode ser o do leitor)
+        leitor: LeitorApkg do baralho existente (é fechado antes de substituir o arquivo)
+        timestamp: Timestamp das notas/cartas (padrão: agora)
+        atualizacoes: Tuplas (guid, campos) de notas existentes a regravar (ver _anexar_na_colecao)
+    """
+    temp_path = f"{output_path}.tmp"
+    try:
+        _escrever_pacote(package, temp_path, leitor, timestamp, atualizacoes)
+        if leitor is not None:
+            # Fechar antes de substituir o arquivo (necessário no Windows)
+            leitor.fechar()
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def escrever_apkg_em_memoria(package, leitor=None, timestamp=None, limite=APKG_MAX_MEMORIA, atualizacoes=()):
+    """
+    Monta um genanki.Package (mesclado a um .apkg existente, se houver leitor)
+    em um buffer, sem gravar o pacote em disco.
+
+    O buffer é um SpooledTemporaryFile: fica na memória até `limite` bytes e
+    só passa para um arquivo temporário acima disso. A coleção também é
+    montada em memória quando cabe em COLECAO_MAX_MEMORIA.
+
+    Args:
+        package: genanki.Package com o baralho e as mídias novas
+        leitor: LeitorApkg do baralho existente (opcional, não é alterado)
+        timestamp: Timestamp das notas/cartas (padrão: agora)
+        limite: Tamanho (bytes) a partir do qual o buffer vai para o disco
+        atualizacoes: Tuplas (guid, campos) de notas existentes a regravar (ver _anexar_na_colecao)
+
+    Returns:
+        SpooledTemporaryFile com o .apkg, posicionado no início
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=limite, suffix='.apkg')
+    try:
+        _escrever_pacote(package, buffer, leitor, timestamp, atualizacoes)
+    except BaseException:
+        buffer.close()
+        raise
+    buffer.seek(0)
+    return buffer
+
+
+def _escrever_pacote(package, destino, leitor=None, timestamp=None, atualizacoes=()):
+    """Grava o zip do pacote em destino (caminho ou arquivo aberto)."""
+    with EscritorApkg(destino) as escritor:
+        for path in package.media_files:
+            escritor.adicionar_midia(os.path.basename(path), path=path)
+        escritor.finalizar(package, leitor, timestamp, atualizacoes)
+
+
+class EscritorApkg:
+    """
+    Grava um .apkg aos poucos: as mídias entram no zip assim que ficam
+    prontas, e a coleção e o mapa 'media' só no fim, quando as notas já
+    são conhecidas.
+
+    Permite montar o pacote enquanto os áudios ainda estão sendo
+    sintetizados, sem pasta de áudios intermediária. Uma mídia adicionada
+    duas vezes (mesmo nome) é gravada uma vez só.
+
+    Uso:
+        with EscritorApkg(destino) as escritor:
+            escritor.adicionar_midia('audio_x.mp3', dados=mp3)
+            escritor.finalizar(package, leitor)
+    """
+
+    def __init__(self, destino):
+        """
+        Args:
+            destino: Caminho ou arquivo aberto (ex.: SpooledTemporaryFile) do .apkg de saída
+        """
+        self.zip = zipfile.ZipFile(destino, 'w')
+        self.midias = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.fechar()
+
+    def adicionar_midia(self, nome, dados=None, path=None):
+        """
+        Grava uma mídia no pacote.
+
+        Args:
+            nome: Nome do arquivo de mídia no Anki (ex.: audio_<hash>.mp3)
+            dados: Conteúdo da mídia (bytes)
+            path: Caminho do arquivo da mídia (usado se dados não for informado)
+        """
+        if nome in self.midias:
+            return
+        membro = str(len(self.midias))
+        if dados is not None:
+            self.zip.writestr(membro, dados)
+        else:
+            self.zip.write(path, membro)
+        self.midias[nome] = membro
+
+    def finalizar(self, package, leitor=None, timestamp=None, atualizacoes=()):
+        """
+        Grava a coleção e o mapa 'media' e fecha o zip.
+
+        Com um leitor, as notas do pacote são acrescentadas à coleção do
+        baralho existente, e as mídias antigas (exceto as substituídas por uma
+        nova de mesmo nome) são copiadas membro a membro, sem recompactar.
+
+        Args:
+            package: genanki.Package com o baralho (as mídias já foram adicionadas)
+            leitor: LeitorApkg do baralho existente (opcional, não é alterado nem fechado)
+            timestamp: Timestamp das notas/cartas (padrão: agora)
+            atualizacoes: Tuplas (guid, campos) de notas do baralho existente a regravar
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        info_colecao = leitor.membro_colecao() if leitor is not None else None
+        if leitor is not None and info_colecao is None:
+            raise zipfile.BadZipFile(f"{leitor.apkg_path} não contém uma coleção do Anki")
+
+        # A coleção é montada em memória quando cabe; senão, em um arquivo temporário
+        em_memoria = hasattr(sqlite3.Connection, 'serialize') and (
+            info_colecao is None or info_colecao.file_size <= COLECAO_MAX_MEMORIA
+        )
+        db_path = None
+        membro_colecao = info_colecao.filename if info_colecao is not None else 'collection.anki2'
+
+        try:
+            if em_memoria:
+                conn = sqlite3.connect(':memory:')
+                if leitor is not None:
+                    conn.deserialize(leitor.zip.read(info_colecao))
+            else:
+                db_handle, db_path = tempfile.mkstemp(suffix='.anki2')
+                os.close(db_handle)
+                if leitor is not None:
+                    leitor.copiar_colecao(db_path)
+                conn = sqlite3.connect(db_path)
+
+            try:
+                if leitor is not None:
+                    _anexar_na_colecao(conn, package, timestamp, atualizacoes)
+                else:
+                    package.write_to_db(conn.cursor(), timestamp, itertools.count(int(timestamp * 1000)))
+                    conn.commit()
+                dados_colecao = conn.serialize() if em_memoria else None
+            finally:
+                conn.close()
+
+            if em_memoria:
+                self.zip.writestr(membro_colecao, dados_colecao)
+            else:
+                self.zip.write(db_path, membro_colecao)
+
+            # Mídias antigas que não foram substituídas por uma nova, numeradas depois das novas
+            media_json = {membro: nome for nome, membro in self.midias.items()}
+            if leitor is not None:
+                for info, nome in leitor.membros_midia():
+                    if nome not in self.midias:
+                        membro = str(len(media_json))
+                        copiar_membro_bruto(leitor.zip, self.zip, info, membro)
+                        media_json[membro] = nome
+            self.zip.writestr('media', json.dumps(media_json))
+        finally:
+            if db_path and os.path.exists(db_path):
+                os.remove(db_path)
+
+        self.zip.close()
+
+    def fechar(self):
+        """Fecha o zip; sem finalizar, o pacote fica incompleto e deve ser descartado."""
+        self.zip.close()
+
+
+def anexar_apkg(apkg_path, package, timestamp=None, atualizacoes=()):
+    """
+    Acrescenta as notas e mídias de um genanki.Package a um .apkg existente,
+    sem regravar o que já está nele.
+
+    As notas novas são inseridas na coleção existente, e o zip é aberto em
+    modo de anexação: só a coleção, o mapa 'media' e as mídias novas são
+    gravados no fim do arquivo; as mídias antigas continuam onde estão. O
+    custo é proporcional ao que foi adicionado (mais o tamanho da coleção),
+    não ao tamanho do baralho. As versões antigas da coleção e do mapa viram
+    espaço morto no arquivo, que é compactado quando passa do limite.
+
+    Baralhos até APKG_ANEXAR_COPIA_MAX são anexados em uma cópia, conferida
+    (_verificar_apkg) e trocada pelo original com os.replace: uma interrupção
+    deixa o baralho antigo intacto. Acima disso, copiar custaria mais que o
+    anexo, e o arquivo é alterado no lugar; uma interrupção durante a gravação
+    pode corrompê-lo. Sem os internos do zipfile usados aqui (ZIP_INTERNOS),
+    o pacote é regravado inteiro com escrever_apkg.
+
+    Args:
+        apkg_path: Caminho do arquivo .apkg existente
+        package: genanki.Package com as notas e mídias novas
+        timestamp: Timestamp das notas/cartas (padrão: agora)
+        atualizacoes: Tuplas (guid, campos) de notas existentes a regravar (ver _anexar_na_colecao)
+    """
+    if timestamp is None:
+        timestamp = time.time()
+
+    if not ZIP_INTERNOS:
+        with LeitorApkg(apkg_path) as leitor:
+            escrever_apkg(package, apkg_path, leitor, timestamp, atualizacoes)
+        return
+
+    if os.path.getsize(apkg_path) > APKG_ANEXAR_COPIA_MAX:
+        _anexar_no_arquivo(apkg_path, package, timestamp, atualizacoes)
+        return
+
+    temp_path = f"{apkg_path}.tmp"
+    try:
+        shutil.copyfile(apkg_path, temp_path)
+        _anexar_no_arquivo(temp_path, package, timestamp, atualizacoes)
+        _verificar_apkg(temp_path)
+        os.replace(temp_path, apkg_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _anexar_no_arquivo(apkg_path, package, timestamp, atualizacoes):
+    """Anexa o pacote ao .apkg no lugar (ver anexar_apkg)."""
+    db_handle, db_path = tempfile.mkstemp(suffix='.anki2')
+    os.close(db_handle)
+
+    try:
+        with LeitorApkg(apkg_path, 'a') as leitor:
+            zf = leitor.zip
+            membro_colecao = leitor.copiar_colecao(db_path)
+            conn = sqlite3.connect(db_path)
+            _anexar_na_colecao(conn, package, timestamp, atualizacoes)
+            conn.close()
+
+            mapa = dict(leitor.mapa_midia())
+            novas = list(package.media_files)
+            nomes_novos = {os.path.basename(path) for path in novas}
+
+            # Mídias antigas com o mesmo nome de uma nova são substituídas
+            for membro, nome in list(mapa.items()):
+                if nome in nomes_novos:
+                    del mapa[membro]
+                    _remover_membro(zf, membro)
+
+            # A coleção e o mapa antigos saem do diretório central e viram espaço morto
+            _remover_membro(zf, membro_colecao)
+            _remover_membro(zf, 'media')
+
+            proximo = max((int(membro) for membro in mapa if membro.isdigit()), default=-1) + 1
+            novos_membros = []
+            for path in novas:
+                membro = str(proximo)
+                proximo += 1
+                mapa[membro] = os.path.basename(path)
+                novos_membros.append((membro, path))
+
+            zf.write(db_path, membro_colecao)
+            zf.writestr('media', json.dumps(mapa))
+            for membro, path in novos_membros:
+                zf.write(path, membro)
+
+            espaco_morto = _espaco_morto(zf)
+            espaco_vivo = zf.start_dir - espaco_morto
+    finally:
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
+    if espaco_morto > max(ESPACO_MORTO_MINIMO, espaco_vivo * ESPACO_MORTO_PROPORCAO):
+        compactar_apkg(apkg_path)
+
+
+def _verificar_apkg(apkg_path):
+    """
+    Confere a estrutura de um .apkg: a coleção e todos os membros do mapa 'media'
+    precisam estar no diretório central.
+
+    Raises:
+        zipfile.BadZipFile: Se o pacote estiver incompleto
+    """
+    with zipfile.ZipFile(apkg_path) as zf:
+        nomes = set(zf.namelist())
+        if not nomes.intersection(MEMBROS_COLECAO):
+            raise zipfile.BadZipFile(f"Pacote sem coleção: {apkg_path}")
+        faltando = set(json.loads(zf.read('media'))) - nomes
+        if faltando:
+            raise zipfile.BadZipFile(f"Pacote sem {len(faltando)} mídias do mapa: {apkg_path}")
+
+
+def compactar_apkg(apkg_path):
+    """
+    Regrava um .apkg só com os membros em uso, descartando o espaço morto
+    deixado por anexar_apkg. Os membros são copiados sem recompactação.
+
+    Args:
+        apkg_path: Caminho do arquivo .apkg
+    """
+    temp_path = f"{apkg_path}.tmp"
+    try:
+        with zipfile.ZipFile(apkg_path, 'r') as origem, zipfile.ZipFile(temp_path, 'w') as destino:
+            for info in origem.infolist():
+                copiar_membro_bruto(origem, destino, info)
+        os.replace(temp_path, apkg_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _anexar_na_colecao(conn, package, timestamp, atualizacoes=()):
+    """
+    Insere os baralhos/notas de um genanki.Package em uma coleção existente.
+
+    As notas em atualizacoes (tuplas (guid, lista de campos)) têm os campos
+    regravados no lugar, mantendo id, guid e cartas (e portanto o histórico
+    de revisões): com o mod mais novo, o Anki atualiza a nota ao importar.
+    """
+    cursor = conn.cursor()
+
+    cursor.executemany(
+        "UPDATE notes SET flds = ?, sfld = ?, csum = ?, mod = ?, usn = -1 WHERE guid = ?",
+        (
+            ('\x1f'.join(campos), campos[0], _checksum_campo(campos[0]), int(timestamp), guid)
+            for guid, campos in atualizacoes
+        )
+    )
+
+    # Os ids novos começam depois de todos os existentes, mesmo que o
+    # baralho tenha sido gerado há poucos instantes
+    inicio = int(timestamp * 1000)
+    for tabela in ('notes', 'cards'):
+        (maximo,) = cursor.execute(f"SELECT MAX(id) FROM {tabela}").fetchone()
+        if maximo is not None:
+            inicio = max(inicio, maximo + 1)
+    id_gen = itertools.count(inicio)
+
+    for deck in package.decks:
+        deck.write_to_db(cursor, timestamp, id_gen)
+
+    # O genanki grava os ids dos modelos como int; recarregar o JSON elimina
+    # as chaves duplicadas com as strings que já estavam na coleção
+    (models,) = cursor.execute("SELECT models FROM col").fetchone()
+    cursor.execute("UPDATE col SET models = ?, mod = ?", (json.dumps(json.loads(models)), int(timestamp * 1000)))
+    conn.commit()
+
+
+def _checksum_campo(texto):
+    """Checksum do campo de ordenação, como o Anki calcula (sha1 do texto sem HTML)."""
+    texto = re.sub(r'\[sound:[^\]]+\]|<[^>]*>', '', texto)
+    return int(hashlib.sha1(texto.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def _remover_membro(zf, nome):
+    """Tira um membro do diretório central de um zip aberto em modo 'a'."""
+    info = zf.NameToInfo.pop(nome, None)
+    if info is not None:
+        zf.filelist.remove(info)
+        zf._didModify = True
+
+
+def _espaco_morto(zf):
+    """Bytes do zip ocupados por membros que não estão no diretório central."""
+    vivo = sum(
+        zipfile.sizeFileHeader + len(info.filename.encode('utf-8')) + len(info.extra) + info.compress_size
+        for info in zf.filelist
+    )
+    return max(0, zf.start_dir - vivo)
+
+
+def copiar_membro_bruto(origem, destino, info, nome=None):
+    """
+    Copia um membro de um zip para outro exatamente como está gravado
+    (os bytes comprimidos são transferidos sem descompactar nem recompactar).
+
+    Args:
+        origem: zipfile.ZipFile aberto para leitura
+        destino: zipfile.ZipFile aberto para escrita
+        info: ZipInfo do membro na origem
+        nome: Nome do membro no destino (padrão: o mesmo da origem)
+    """
+    if info.flag_bits & 0x1:
+        raise zipfile.BadZipFile(f"Membro criptografado não suportado: {info.filename}")
+
+    novo = zipfile.ZipInfo(nome or info.filename, info.date_time)
+    novo.compress_type = info.compress_type
+    novo.CRC = info.CRC
+    novo.compress_size = info.compress_size
+    novo.file_size = info.file_size
+    novo.create_system = info.create_system
+    novo.external_attr = info.external_attr
+    # Manter só os bits do nível de compressão (sem data descriptor)
+    novo.flag_bits = info.flag_bits & 0x06
+
+    if not ZIP_INTERNOS:
+        # Sem os internos do zipfile: descompactar e recompactar
+        destino.writestr(novo, origem.read(info))
+        return
+
+    with origem._lock, destino._lock:
+        # Pular o cabeçalho local da origem para chegar aos dados comprimidos
+        origem.fp.seek(info.header_offset)
+        cabecalho = origem.fp.read(zipfile.sizeFileHeader)
+        if len(cabecalho) != zipfile.sizeFileHeader or cabecalho[:4] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile(f"Cabeçalho inválido para o membro {info.filename}")
+        tamanho_nome, tamanho_extra = struct.unpack('<HH', cabecalho[26:30])
+        origem.fp.seek(info.header_offset + zipfile.sizeFileHeader + tamanho_nome + tamanho_extra)
+
+        destino.fp.seek(destino.start_dir)
+        novo.header_offset = destino.fp.tell()
+        destino.fp.write(novo.FileHeader())
+
+        restante = info.compress_size
+        while restante > 0:
+            bloco = origem.fp.read(min(TAMANHO_BLOCO, restante))
+            if not bloco:
+                raise zipfile.BadZipFile(f"Membro truncado: {info.filename}")
+            destino.fp.write(bloco)
+            restante -= len(bloco)
+
+        destino.start_dir = destino.fp.tell()
+        destino.filelist.append(novo)
+        destino.NameToInfo[novo.filename] = novo
+        destino._didModify = True
+
+
+def _zip_internos_disponiveis():
+    """
+    Confere se o zipfile desta versão do Python tem os atributos internos usados
+    em anexar_apkg e copiar_membro_bruto (NameToInfo, filelist, _didModify,
+    _lock, fp e start_dir).
+    """
+    try:
+        with zipfile.ZipFile(io.BytesIO(), 'w') as zf:
+            return all(hasattr(zf, atributo)
+                       for atributo in ('NameToInfo', 'filelist', '_didModify', '_lock', 'fp', 'start_dir'))
+    except Exception:
+        return False
+
+
+ZIP_INTERNOS = _zip_internos_disponiveis()
@@ -2,7 +2,20 @@ import streamlit as st
 import pandas as pd
 import os
 import io
-from utils import criar_audios, gerar_links_audios, criar_baralho_anki, limpar_arquivos_temporarios
+import hashlib
+import logging
+import time
+import itertools
+import numpy as np
+from utils import criar_audios, gerar_links_audios, criar_baralho_anki, limpar_arquivos_temporarios, carregar_cartas_baralho, chave_carta, caminho_baralho, diferenca_planilhas
+from ingest import carregar_planilha
+from tts import BACKENDS, MANIFESTO_NOME, TTS_BACKEND_PADRAO, listar_backends_disponiveis
+from jobs import GerenciadorJobs
+from metrics import exportar_prometheus
+from workspace import TravaArquivo, Workspace, coletar_lixo
+
+# Pipeline progress goes to the console through logging (set ANKI_TRACE_FILE for a JSON-lines trace)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
 
 # Page configuration
 st.set_page_config(
@@ -291,9 +304,305 @@ st.markdown("""
     </div>
 """, unsafe_allow_html=True)
 
+# Parsed uploads are shared across sessions and keyed on the file's content,
+# so re-uploading the same sheet (in any tab) skips parsing entirely
+@st.cache_data(max_entries=32, show_spinner=False)
+def ler_upload(hash_conteudo, extensao, _conteudo):
+    return carregar_planilha(io.BytesIO(_conteudo), f"upload{extensao}")
+
+
+def hash_upload(arquivo):
+    # Hash each uploaded file once, not on every rerun
+    hashes = st.session_state.setdefault('upload_hashes', {})
+    file_id = getattr(arquivo, 'file_id', None) or f"{arquivo.name}_{arquivo.size}"
+    if file_id not in hashes:
+        hashes.clear()
+        hashes[file_id] = hashlib.sha256(arquivo.getvalue()).hexdigest()
+    return hashes[file_id]
+
+
+def hash_dataframe(df):
+    # Content hash of a DataFrame version; computed once, when the version is stored in the session
+    h = hashlib.sha256('\x1f'.join(map(str, df.columns)).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return h.hexdigest()
+
+
+# Export artifacts are built only when asked for and memoized on the DataFrame's
+# content, so reruns (any widget interaction) don't re-serialize the workbook
+@st.cache_data(max_entries=8, show_spinner=False)
+def exportar_excel(hash_df, _df):
+    buffer = io.BytesIO()
+    _df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+# Column stats and search results are computed once per sheet version, shared across sessions
+@st.cache_data(max_entries=8, show_spinner=False)
+def estatisticas_planilha(hash_df, _df):
+    def vazio(coluna):
+        if coluna not in _df.columns:
+            return pd.Series(True, index=_df.index)
+        return _df[coluna].isna() | (_df[coluna].astype(str).str.strip() == '')
+    
+    # Same normalization as utils.chave_carta, vectorized
+    def normalizar(coluna):
+        return _df[coluna].where(_df[coluna].notna(), '').astype(str).str.strip().str.lower()
+    chaves = normalizar('Word') + '|' + normalizar('Context')
+    return {
+        'sem_traducao': int(vazio('Translation').sum()),
+        'sem_fonetica': int(vazio('Phonetic').sum()),
+        'chaves_duplicadas': int(chaves.duplicated(keep=False).sum()),
+    }
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def buscar_linhas(hash_df, termo, _df):
+    # Row positions where any column contains the term (case-insensitive)
+    encontrado = pd.Series(False, index=_df.index)
+    for coluna in _df.columns:
+        encontrado |= _df[coluna].astype(str).str.contains(termo, case=False, regex=False, na=False)
+    return encontrado.to_numpy().nonzero()[0]
+
+
+@st.fragment
+def mostrar_preview(df, hash_df):
+    # Only the visible page is sliced on the server and sent to the browser;
+    # paging and searching rerun just this fragment
+    col_busca, col_tamanho = st.columns([3, 1])
+    with col_busca:
+        termo = st.text_input("🔍 Search", key="preview_busca", placeholder="Word, translation, context...").strip()
+    with col_tamanho:
+        tamanho_pagina = st.selectbox("Rows per page", [50, 100, 500], key="preview_tamanho")
+    
+    posicoes = buscar_linhas(hash_df, termo, df) if termo else None
+    total = len(df) if posicoes is None else len(posicoes)
+    paginas = max(1, -(-total // tamanho_pagina))
+    pagina = st.number_input(f"Page (of {paginas})", min_value=1, max_value=paginas, value=1, key="preview_pagina")
+    
+    inicio = (min(pagina, paginas) - 1) * tamanho_pagina
+    fim = min(inicio + tamanho_pagina, total)
+    trecho = df.iloc[inicio:fim] if posicoes is None else df.iloc[posicoes[inicio:fim]]
+    st.dataframe(trecho, use_container_width=True, height=400)
+    st.caption(f"Rows {inicio + 1 if total else 0}–{fim} of {total}" + (f" matching “{termo}”" if termo else ""))
+
+
+def assinatura_baralho(deck_name):
+    # Changes whenever any session rewrites the saved deck
+    try:
+        stat = os.stat(caminho_baralho(deck_name))
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def audios_presentes(audio_dir, df):
+    # The folder goes away with its workspace; its manifest exists once any clip was made or reused
+    if not audio_dir or not os.path.isdir(audio_dir):
+        return False
+    tem_links = any(df[coluna].fillna('').astype(bool).any() for coluna in ('Audio_Word', 'Audio_Context')
+                    if coluna in df.columns)
+    return not tem_links or os.path.exists(os.path.join(audio_dir, MANIFESTO_NOME))
+
+
+def ler_apkg_exportado(apkg):
+    # Called by the download button only when clicked
+    if apkg['buffer'] is not None:
+        apkg['buffer'].seek(0)
+        return apkg['buffer'].read()
+    # The deck file is shared with other sessions, so read it under its lock
+    with TravaArquivo(apkg['caminho']):
+        with open(apkg['caminho'], "rb") as f:
+            return f.read()
+
+
+def comparar_versoes(base, df):
+    # Diff a re-uploaded sheet against the last processed version of this session, row by row
+    inalteradas, editadas, _ = diferenca_planilhas(base['df'], df)
+    pendentes_base = set(base['pendentes'])
+    
+    def chave_no_baralho(posicao_base):
+        # Key the deck holds for a row of the base version (None if the row never reached the deck)
+        if posicao_base in base['chaves_anteriores']:
+            return base['chaves_anteriores'][posicao_base]
+        if posicao_base in pendentes_base:
+            return None
+        return chave_carta(base['df']['Word'].iat[posicao_base], base['df']['Context'].iat[posicao_base])
+    
+    # Edited rows rewrite the note they came from; unchanged rows carry over edits not packaged yet
+    chaves_anteriores = {}
+    for posicao, posicao_base in itertools.chain(editadas.items(), inalteradas.items()):
+        if posicao in editadas or posicao_base in base['chaves_anteriores']:
+            chave = chave_no_baralho(posicao_base)
+            if chave is not None:
+                chaves_anteriores[posicao] = chave
+    
+    return {
+        'df': base['df'],
+        'audio_dir': base['audio_dir'],
+        'config': base['config'],
+        'baralho': base['baralho'],
+        'inalteradas': inalteradas,
+        'chaves_anteriores': chaves_anteriores,
+        # Rows the deck doesn't have in their current form
+        'pendentes': [posicao for posicao in range(len(df))
+                      if posicao not in inalteradas or inalteradas[posicao] in pendentes_base],
+    }
+
+
+def processar_audios(job, workspace, df, deck_name, excel_path, audio_speed, tts_backend, diferenca=None):
+    # Runs in the job pool, outside the script run: no st.* calls in here
+    ultimo_toque = [time.monotonic()]
+    
+    def progresso(concluidos, total):
+        job.progresso(concluidos, total)
+        # Keep the workspace from being garbage-collected while the job runs
+        if time.monotonic() - ultimo_toque[0] > 30:
+            workspace.tocar()
+            ultimo_toque[0] = time.monotonic()
+    
+    config = (deck_name, audio_speed, tts_backend)
+    audio_folder_name = f"Audios_{deck_name.replace(' ', '_')}"
+    
+    # Rows unchanged since the last processed version keep their audio links,
+    # so only edited and new rows go through synthesis
+    reaproveitar = (
+        diferenca is not None and diferenca['config'] == config
+        and diferenca['audio_dir'] == os.path.join(workspace.caminho, audio_folder_name)
+        and os.path.isdir(diferenca['audio_dir'])
+    )
+    if reaproveitar:
+        alteradas = [posicao for posicao in range(len(df)) if posicao not in diferenca['inalteradas']]
+    else:
+        alteradas = list(range(len(df)))
+    df_alteradas = df.iloc[alteradas]
+    
+    # Cards already in the target deck are skipped, so don't synthesize them
+    # (edited cards are rewritten in place, so they keep getting audio)
+    editadas = set(diferenca['chaves_anteriores']) if diferenca is not None else set()
+    cartas_existentes = carregar_cartas_baralho(
+        deck_name,
+        [chave_carta(w, c) for posicao, w, c in zip(alteradas, df_alteradas['Word'], df_alteradas['Context'])
+         if posicao not in editadas]
+    )
+    
+    # Create audio files
+    audio_dir = criar_audios(
+        df_alteradas,
+        audio_folder_name,
+        speed=audio_speed,
+        backend=tts_backend,
+        cartas_existentes=cartas_existentes,
+        progresso=progresso,
+        cancelar=job.evento_cancelar,
+        pasta=workspace.caminho
+    )
+    
+    # Generate links
+    df_com_audios = gerar_links_audios(
+        df_alteradas,
+        audio_dir,
+        excel_path,
+        deck_name,
+        speed=audio_speed,
+        backend=tts_backend,
+        cartas_existentes=cartas_existentes
+    )
+    
+    if reaproveitar:
+        # Unchanged rows take their links from the previous version
+        df_links = df_com_audios
+        df_com_audios = df.copy()
+        posicoes, posicoes_base = (list(lado) for lado in zip(*diferenca['inalteradas'].items())) \
+            if diferenca['inalteradas'] else ([], [])
+        for coluna in ('Audio_Word', 'Audio_Context'):
+            valores = np.empty(len(df), dtype=object)
+            valores[posicoes] = diferenca['df'][coluna].to_numpy()[posicoes_base]
+            valores[alteradas] = df_links[coluna].to_numpy()
+            df_com_audios[coluna] = valores
+    
+    # What the saved deck is missing from this version, for the next package build and re-upload
+    versao = {
+        'df': df_com_audios,
+        'audio_dir': audio_dir,
+        'config': config,
+        'baralho': diferenca['baralho'] if diferenca is not None else deck_name,
+        'pendentes': diferenca['pendentes'] if diferenca is not None else list(range(len(df))),
+        'chaves_anteriores': diferenca['chaves_anteriores'] if diferenca is not None else {},
+    }
+    return df_com_audios, audio_dir, versao
+
+
+# The job pool lives outside script reruns and sessions, so synthesis keeps going
+# while the page refreshes and the server stays responsive for other users
+@st.cache_resource
+def obter_gerenciador_jobs():
+    return GerenciadorJobs()
+
+
+def formatar_duracao(segundos):
+    if segundos is None:
+        return "--:--"
+    minutos, segundos = divmod(int(segundos), 60)
+    return f"{minutos // 60}:{minutos % 60:02d}:{segundos:02d}" if minutos >= 60 else f"{minutos}:{segundos:02d}"
+
+
+def obter_workspace():
+    # Each browser session gets its own folder for audio and temp files. Its id rides in
+    # the URL, so a refreshed page gets the same workspace (and its running job) back
+    if 'workspace_id' not in st.session_state:
+        workspace_id = st.query_params.get('ws')
+        workspace = Workspace(workspace_id if Workspace.existe(workspace_id) else None)
+        st.session_state.workspace_id = workspace.id
+        st.query_params['ws'] = workspace.id
+        # New sessions sweep workspaces abandoned by old ones
+        coletar_lixo(protegidos={workspace.id})
+        return workspace
+    return Workspace(st.session_state.workspace_id)
+
+
+@st.fragment(run_every=1.0)
+def acompanhar_job():
+    obter_workspace()  # Opening the workspace refreshes its activity mark
+    job = obter_gerenciador_jobs().obter(st.session_state.audio_job_id)
+    if job is None:
+        st.session_state.audio_job_id = None
+        st.rerun()
+    
+    if job.finalizado:
+        st.session_state.audio_job_id = None
+        if job.status == 'concluido':
+            df_com_audios, audio_dir, versao = job.resultado
+            st.session_state.df = df_com_audios
+            st.session_state.df_hash = versao['df_hash'] = hash_dataframe(df_com_audios)
+            st.session_state.versao_processada = versao
+            st.session_state.audio_dir = audio_dir
+            st.session_state.audios_gerados = True
+        elif job.status == 'cancelado':
+            st.session_state.aviso_job = "⏹️ Audio generation cancelled. Clips already created are cached and will be reused."
+        else:
+            st.session_state.aviso_job = f"⚠️ Error generating audio: {job.erro}"
+        st.rerun(scope="app")
+    
+    fracao = job.concluidos / job.total if job.total else 0.0
+    if job.cancelado:
+        texto = "⏹️ Cancelling..."
+    elif not job.total:
+        texto = "🎤 Preparing..."
+    else:
+        texto = (f"🎤 {job.concluidos}/{job.total} clips · {job.velocidade():.1f} clips/s · "
+                 f"ETA {formatar_duracao(job.eta())}")
+    st.progress(min(fracao, 1.0), text=texto)
+    
+    if st.button("⏹️ Cancel", disabled=job.cancelado, key="cancelar_job"):
+        job.cancelar()
+
+
 # Initialize session state
 if 'df' not in st.session_state:
     st.session_state.df = None
+if 'df_hash' not in st.session_state:
+    st.session_state.df_hash = None
 if 'audio_dir' not in st.session_state:
     st.session_state.audio_dir = None
 if 'audios_gerados' not in st.session_state:
@@ -302,6 +611,10 @@ if 'excel_path' not in st.session_state:
     st.session_state.excel_path = None
 if 'last_upload_id' not in st.session_state:
     st.session_state.last_upload_id = None
+if 'audio_job_id' not in st.session_state:
+    st.session_state.audio_job_id = None
+
+workspace = obter_workspace()
 
 # Inline settings (replaces sidebar)
 st.markdown('<div class="tracker-card">', unsafe_allow_html=True)
@@ -315,7 +628,20 @@ with col1:
 with col2:
     audio_speed = st.slider("⚡ Audio Speed", 0.5, 2.0, 1.0, 0.1, key="audio_speed_slider", help="1.0 = normal speed")
 
-st.info("🎤 Using Google Text-to-Speech (English voice)")
+# The fake backend only exists for tests and benchmarks
+tts_backends = [nome for nome in listar_backends_disponiveis() if nome != 'fake']
+tts_backend_padrao = os.environ.get('ANKI_TTS_BACKEND', TTS_BACKEND_PADRAO)
+if len(tts_backends) > 1:
+    tts_backend = st.selectbox(
+        "🎤 Voice Engine",
+        tts_backends,
+        index=tts_backends.index(tts_backend_padrao) if tts_backend_padrao in tts_backends else 0,
+        format_func=lambda nome: BACKENDS[nome].descricao,
+        key="tts_backend_select"
+    )
+else:
+    tts_backend = tts_backends[0] if tts_backends else tts_backend_padrao
+    st.info(f"🎤 Using {BACKENDS[tts_backend].descricao} (English voice)")
 
 deck_id = 2059400110
 model_id = 1607392319
@@ -329,8 +655,8 @@ st.markdown('<div class="tracker-card">', unsafe_allow_html=True)
 st.markdown("<h2>📁 Upload Excel File</h2>", unsafe_allow_html=True)
 
 uploaded_file = st.file_uploader(
-    "Drag your Excel file here or click to select",
-    type=['xlsx', 'xls'],
+    "Drag your Excel, CSV or Parquet file here or click to select",
+    type=['xlsx', 'xls', 'csv', 'parquet'],
     help="Format: Word | Translation | Phonetic | Context",
     key="file_uploader"
 )
@@ -339,6 +665,7 @@ uploaded_file = st.file_uploader(
 if not uploaded_file:
     if st.session_state.df is not None:
         st.session_state.df = None
+        st.session_state.df_hash = None
         st.session_state.audio_dir = None
         st.session_state.audios_gerados = False
         st.session_state.excel_path = None
@@ -347,32 +674,34 @@ if not uploaded_file:
 
 if uploaded_file:
     # Check if it's a new file OR if state needs reset
-    current_upload_id = f"{uploaded_file.name}_{uploaded_file.size}"
+    current_upload_id = hash_upload(uploaded_file)
     
     if current_upload_id != st.session_state.last_upload_id:
         # Reset all state for new file
         st.session_state.audios_gerados = False
         st.session_state.audio_dir = None
+        st.session_state.apkg_exportado = None
+        st.session_state.diferenca = None
         
-        # Read Excel directly from uploaded file buffer
+        # Read the sheet in chunks straight from the uploaded file buffer;
+        # columns are identified automatically by position
         try:
-            df = pd.read_excel(uploaded_file)
+            df_renamed = ler_upload(
+                current_upload_id,
+                os.path.splitext(uploaded_file.name)[1].lower(),
+                uploaded_file.getvalue()
+            )
         except Exception as e:
-            st.error(f"⚠️ Error reading Excel file: {str(e)}")
+            st.error(f"⚠️ Error reading file: {str(e)}")
             st.stop()
         
-        # Automatically identify columns
-        if len(df.columns) >= 4:
-            df_renamed = df.iloc[:, [0, 1, 2, 3]].copy()
-            df_renamed.columns = ['Word', 'Translation', 'Phonetic', 'Context']
-        elif len(df.columns) == 3:
-            df_renamed = df.iloc[:, [0, 1, 2]].copy()
-            df_renamed.columns = ['Word', 'Translation', 'Context']
-        else:
-            df_renamed = df.iloc[:, [0, 1]].copy()
-            df_renamed.columns = ['Word', 'Context']
-        
         st.session_state.df = df_renamed
+        st.session_state.df_hash = hash_dataframe(df_renamed)
+        
+        # A re-upload of a sheet this session already processed is diffed against it,
+        # so only the edited and new rows are synthesized and packaged again
+        if st.session_state.get('versao_processada') is not None:
+            st.session_state.diferenca = comparar_versoes(st.session_state.versao_processada, df_renamed)
         st.session_state.excel_path = uploaded_file.name  # Store just the name
         st.session_state.last_upload_id = current_upload_id
         st.rerun()  # Force UI refresh to clear audio preview
@@ -401,12 +730,50 @@ if uploaded_file:
             </div>
         """.format(len(st.session_state.df), len(st.session_state.df.columns)), unsafe_allow_html=True)
         
-        # Data preview - show all rows
+        estatisticas = estatisticas_planilha(st.session_state.df_hash, st.session_state.df)
+        st.markdown("""
+            <div class="metrics-row">
+                <div class="metric-card">
+                    <div class="metric-icon">🌐</div>
+                    <div class="metric-value">{}</div>
+                    <div class="metric-label">Missing Translations</div>
+                </div>
+                <div class="metric-card">
+                    <div class="metric-icon">🔤</div>
+                    <div class="metric-value">{}</div>
+                    <div class="metric-label">Missing Phonetics</div>
+                </div>
+                <div class="metric-card">
+                    <div class="metric-icon">🔁</div>
+                    <div class="metric-value">{}</div>
+                    <div class="metric-label">Duplicate Rows</div>
+                </div>
+            </div>
+        """.format(estatisticas['sem_traducao'], estatisticas['sem_fonetica'], estatisticas['chaves_duplicadas']),
+            unsafe_allow_html=True)
+        
+        # Data preview - one page at a time
         st.markdown("#### 👀 Data Preview")
-        st.dataframe(st.session_state.df, use_container_width=True, height=400)
+        mostrar_preview(st.session_state.df, st.session_state.df_hash)
 
 st.markdown('</div>', unsafe_allow_html=True)
 
+# Rows already in the deck are skipped when synthesizing, so audio made for another
+# deck name can't be packaged into this one: renaming the deck goes back to step 2
+versao = st.session_state.get('versao_processada')
+if st.session_state.audios_gerados and versao is not None and versao['config'][0] != deck_name:
+    st.session_state.audios_gerados = False
+    st.session_state.audio_dir = None
+    st.session_state.apkg_exportado = None
+    st.session_state.diferenca = None
+
+# An idle workspace can be collected with its audio: package nothing without it, go back to step 2
+if st.session_state.audios_gerados and not audios_presentes(st.session_state.audio_dir, st.session_state.df):
+    st.session_state.audios_gerados = False
+    st.session_state.audio_dir = None
+    st.session_state.apkg_exportado = None
+    st.session_state.aviso_job = "⚠️ The generated audio was cleaned up after a long idle time. Please generate it again."
+
 # ============================================================================
 # STEP 2: Generate Audio Automatically
 # ============================================================================
@@ -416,28 +783,47 @@ if st.session_state.df is not None and not st.session_state.audios_gerados:
     
     st.info("💡 Click the button below to generate audio files automatically.")
     
-    if st.button("🚀 Generate Audio & Process", type="primary", use_container_width=True):
-        with st.spinner("🎤 Creating audio files... This may take a few minutes..."):
-            # Create audio files
-            audio_folder_name = f"Audios_{deck_name.replace(' ', '_')}"
-            audio_dir = criar_audios(
+    if st.session_state.get('aviso_job'):
+        st.warning(st.session_state.pop('aviso_job'))
+    
+    # Jobs are keyed on the workspace, sheet and settings, so a refreshed page re-uploading the
+    # same sheet picks up the running job instead of starting over. Sessions with another
+    # workspace never adopt it: its audio lives in this one, collected once it goes idle
+    chave_job = f"{workspace.id}|{st.session_state.last_upload_id}|{deck_name}|{audio_speed}|{tts_backend}"
+    gerenciador = obter_gerenciador_jobs()
+    job = gerenciador.obter(st.session_state.audio_job_id) if st.session_state.audio_job_id else None
+    if job is not None and job.chave != chave_job:
+        # Settings (or deck name) changed while the job ran: its audio wouldn't match them
+        job.cancelar()
+        st.session_state.audio_job_id = None
+        job = None
+    if job is None:
+        job = gerenciador.ativo(chave_job)
+    
+    diferenca = st.session_state.get('diferenca')
+    if job is None and diferenca is not None:
+        st.info(f"♻️ {len(diferenca['inalteradas'])} rows unchanged since the last version; "
+                f"{len(st.session_state.df) - len(diferenca['inalteradas'])} edited or new rows will be processed.")
+    
+    if job is None:
+        if st.button("🚀 Generate Audio & Process", type="primary", use_container_width=True):
+            job = gerenciador.submeter(
+                processar_audios,
+                workspace,
                 st.session_state.df,
-                audio_folder_name,
-                speed=audio_speed
-            )
-            
-            # Generate links
-            df_com_audios = gerar_links_audios(
-                st.session_state.df,
-                audio_dir,
+                deck_name,
                 st.session_state.excel_path,
-                deck_name
+                audio_speed,
+                tts_backend,
+                diferenca,
+                descricao=f"Audio for {deck_name}",
+                chave=chave_job
             )
-            
-            st.session_state.df = df_com_audios
-            st.session_state.audio_dir = audio_dir
-            st.session_state.audios_gerados = True
+            st.session_state.audio_job_id = job.id
             st.rerun()
+    else:
+        st.session_state.audio_job_id = job.id
+        acompanhar_job()
     
     st.markdown('</div>', unsafe_allow_html=True)
 
@@ -456,17 +842,19 @@ if st.session_state.audios_gerados and st.session_state.audio_dir:
         with st.expander(f"🎵 {i+1}. {st.session_state.df.iloc[i]['Word']}"):
             col1, col2 = st.columns(2)
             
-            audio_path_word = os.path.join(st.session_state.audio_dir, f"word_{i+1}.mp3")
-            audio_path_context = os.path.join(st.session_state.audio_dir, f"context_{i+1}.mp3")
+            audio_file_word = st.session_state.df.iloc[i]['Audio_Word']
+            audio_file_context = st.session_state.df.iloc[i]['Audio_Context']
+            audio_path_word = os.path.join(st.session_state.audio_dir, audio_file_word)
+            audio_path_context = os.path.join(st.session_state.audio_dir, audio_file_context)
             
             with col1:
                 st.markdown("**📝 Word**")
-                if os.path.exists(audio_path_word):
+                if audio_file_word and os.path.exists(audio_path_word):
                     st.audio(audio_path_word)
             
             with col2:
                 st.markdown("**💬 Context**")
-                if os.path.exists(audio_path_context):
+                if audio_file_context and os.path.exists(audio_path_context):
                     st.audio(audio_path_context)
     
     st.markdown('</div>', unsafe_allow_html=True)
@@ -483,50 +871,110 @@ if st.session_state.audios_gerados and st.session_state.audio_dir:
         st.markdown("#### 📊 Excel with Audio Links")
         st.info("Download the Excel file with audio file references added.")
         
-        # Create Excel file in memory
-        excel_buffer = io.BytesIO()
-        st.session_state.df.to_excel(excel_buffer, index=False)
-        excel_buffer.seek(0)
+        # The workbook is only serialized once asked for, then reused until the data changes
+        excel_pedido = st.session_state.get('excel_pedido') == st.session_state.df_hash
+        if not excel_pedido and st.button("📊 Prepare Excel", use_container_width=True):
+            st.session_state.excel_pedido = st.session_state.df_hash
+            excel_pedido = True
         
-        st.download_button(
-            label="⬇️ Download Excel",
-            data=excel_buffer,
-            file_name=f"{deck_name}_with_audio.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            use_container_width=True
-        )
+        if excel_pedido:
+            with st.spinner("📊 Creating Excel..."):
+                dados_excel = exportar_excel(st.session_state.df_hash, st.session_state.df)
+            
+            st.download_button(
+                label="⬇️ Download Excel",
+                data=dados_excel,
+                file_name=f"{deck_name}_with_audio.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                use_container_width=True
+            )
     
     with col2:
         st.markdown("#### 🎴 Anki Deck (.apkg)")
         st.info("Generate and download the complete Anki deck with all audio files.")
         
-        if st.button("📦 Generate .apkg", type="primary", use_container_width=True):
+        # Unchecked: the deck is built in memory and streamed to the browser without touching the server disk
+        salvar_baralho = st.checkbox(
+            "💾 Keep deck on server (new uploads merge into it)",
+            value=os.environ.get('ANKI_SALVAR_BARALHOS', '1') != '0'
+        )
+        
+        # A deck built for this data, name and mode is reused until the saved deck changes
+        chave_apkg = (st.session_state.df_hash, deck_name, deck_id, salvar_baralho)
+        apkg = st.session_state.get('apkg_exportado')
+        if apkg and (apkg['chave'] != chave_apkg or apkg['assinatura'] != assinatura_baralho(deck_name)):
+            if apkg['buffer'] is not None:
+                apkg['buffer'].close()
+            apkg = st.session_state.apkg_exportado = None
+        
+        if st.button("📦 Generate .apkg", type="primary", use_container_width=True) and apkg is None:
             with st.spinner("📦 Creating deck..."):
-                apkg_path, cartas_novas, total_cartas = criar_baralho_anki(
-                    st.session_state.df,
+                # The saved deck already has every row of this version except the pending
+                # ones, so only those are packaged; edited rows update their notes in place
+                versao = st.session_state.get('versao_processada')
+                if (versao is not None and versao.get('df_hash') == st.session_state.df_hash
+                        and versao['baralho'] == deck_name and os.path.exists(caminho_baralho(deck_name))):
+                    df_pacote = st.session_state.df.iloc[versao['pendentes']]
+                    chaves_anteriores = {st.session_state.df.index[posicao]: chave
+                                         for posicao, chave in versao['chaves_anteriores'].items()}
+                else:
+                    df_pacote = st.session_state.df
+                    chaves_anteriores = None
+                
+                resultado_apkg, cartas_novas, total_cartas = criar_baralho_anki(
+                    df_pacote,
                     st.session_state.audio_dir,
                     deck_name,
                     deck_id,
-                    model_id
+                    model_id,
+                    salvar=salvar_baralho,
+                    chaves_anteriores=chaves_anteriores
                 )
                 
-                limpar_arquivos_temporarios()
+                if salvar_baralho and versao is not None and versao.get('df_hash') == st.session_state.df_hash:
+                    # The saved deck now matches this version
+                    versao.update(baralho=deck_name, pendentes=[], chaves_anteriores={})
                 
-                st.success(f"✅ Deck created with {total_cartas} cards!")
+                limpar_arquivos_temporarios(workspace.caminho)
                 
-                # Download button
-                with open(apkg_path, "rb") as f:
-                    st.download_button(
-                        label="⬇️ Download .apkg Deck",
-                        data=f,
-                        file_name=f"{deck_name}.apkg",
-                        mime="application/octet-stream",
-                        use_container_width=True,
-                        key="download_apkg"
-                    )
+                # Only the deck's path (or its spooled buffer, which spills to disk past
+                # APKG_MAX_MEMORIA) is kept in the session; the bytes are read on download
+                apkg = st.session_state.apkg_exportado = {
+                    'chave': chave_apkg,
+                    'assinatura': assinatura_baralho(deck_name),
+                    'caminho': resultado_apkg if salvar_baralho else None,
+                    'buffer': None if salvar_baralho else resultado_apkg,
+                    'total_cartas': total_cartas,
+                }
+        
+        if apkg:
+            st.success(f"✅ Deck created with {apkg['total_cartas']} cards!")
+            
+            # Download button
+            st.download_button(
+                label="⬇️ Download .apkg Deck",
+                data=lambda: ler_apkg_exportado(apkg),
+                file_name=f"{deck_name}.apkg",
+                mime="application/octet-stream",
+                use_container_width=True,
+                key="download_apkg"
+            )
     
     st.markdown('</div>', unsafe_allow_html=True)
 
+# Pipeline metrics (process-wide, in Prometheus text format)
+texto_metricas = exportar_prometheus()
+if texto_metricas:
+    with st.expander("📈 Pipeline metrics"):
+        st.code(texto_metricas, language="text")
+        st.download_button(
+            label="⬇️ Download metrics",
+            data=texto_metricas,
+            file_name="anki_metrics.prom",
+            mime="text/plain",
+            key="download_metrics"
+        )
+
 # Footer
 st.markdown("---")
 st.markdown("""
@@ -0,0 +1,294 @@
+"""
+Benchmark do pipeline de baralhos com dados sintéticos.
+
+Gera planilhas de vocabulário e baralhos .apkg existentes do tamanho pedido,
+usa o backend de TTS fake (offline, determinístico) e mede cada etapa em um
+subprocesso próprio: tempo, pico de memória (RSS) e bytes gravados em disco.
+Os resultados são salvos em JSON para comparar versões.
+
+Uso:
+    python benchmark.py --linhas 1000 10000 100000
+    python benchmark.py --linhas 30000 --existentes 1.0 --saida depois.json --comparar antes.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Etapas medidas, na ordem em que rodam (cada uma usa o que as anteriores gravaram)
+ETAPAS = [
+    'carregar_planilha',
+    'criar_audios',
+    'gerar_links_audios',
+    'criar_baralho_anki',
+    'extrair_cartas_existentes',
+    'extrair_audios_existentes',
+    'gerar_baralho_em_fluxo',
+]
+
+DECK_ID = 2059400110
+MODEL_ID = 1607392319
+BARALHO = 'Benchmark'
+
+
+def gerar_planilha(path, linhas, inicio=0):
+    """
+    Grava uma planilha CSV sintética com Word | Translation | Phonetic | Context.
+
+    Args:
+        path: Caminho do CSV
+        linhas: Número de linhas
+        inicio: Índice da primeira palavra (para gerar planilhas que se sobrepõem)
+    """
+    import pandas as pd
+
+    indices = range(inicio, inicio + linhas)
+    pd.DataFrame({
+        'Word': [f"word{i}" for i in indices],
+        'Translation': [f"palavra {i}" for i in indices],
+        'Phonetic': [f"/wɜːd {i}/" for i in indices],
+        'Context': [f"This is the example sentence number {i} for the word{i}." for i in indices],
+    }).to_csv(path, index=False)
+
+
+def _rss_pico_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta em KB, macOS em bytes
+    return round(pico / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _bytes_gravados():
+    try:
+        with open('/proc/self/io') as f:
+            for linha in f:
+                if linha.startswith('write_bytes:'):
+                    return int(linha.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _executar_etapa(etapa, diretorio):
+    """Roda uma etapa dentro do subprocesso e retorna as medições."""
+    import pandas as pd
+    from ingest import carregar_planilha
+    from tts import BackendFake
+    from utils import criar_audios, criar_baralho_anki, extrair_audios_existentes, \
+        extrair_cartas_existentes, gerar_baralho_em_fluxo, gerar_links_audios
+
+    planilha = os.path.join(diretorio, 'planilha.csv')
+    links = os.path.join(diretorio, 'planilha_links.pkl')
+    audio_dir = os.path.join(tempfile.gettempdir(), f"Audios_{BARALHO}")
+    backend = BackendFake()
+
+    # Entradas carregadas antes da medição, para medir só a etapa
+    if etapa in ('criar_audios', 'gerar_links_audios'):
+        df = carregar_planilha(planilha)
+    elif etapa in ('criar_baralho_anki', 'gerar_baralho_em_fluxo'):
+        df = pd.read_pickle(links) if etapa == 'criar_baralho_anki' else carregar_planilha(planilha)
+        saida = os.path.join(diretorio, f"saida_{etapa}")
+        os.makedirs(saida, exist_ok=True)
+        for nome in (f"{BARALHO}.apkg", f"{BARALHO}.apkg.idx"):
+            origem = os.path.join(diretorio, 'existente', nome)
+            if os.path.exists(origem):
+                shutil.copy2(origem, os.path.join(saida, nome))
+    apkg_existente = os.path.join(diretorio, 'existente', f"{BARALHO}.apkg")
+
+    rss_base = _rss_pico_mb()
+    escrita_inicio = _bytes_gravados()
+    inicio = time.perf_counter()
+
+    detalhes = {}
+    if etapa == 'carregar_planilha':
+        detalhes['linhas'] = len(carregar_planilha(planilha))
+    elif etapa == 'criar_audios':
+        criar_audios(df, f"Audios_{BARALHO}", cache=False, backend=backend)
+    elif etapa == 'gerar_links_audios':
+        gerar_links_audios(df, audio_dir, planilha, BARALHO, backend=backend).to_pickle(links)
+    elif etapa == 'criar_baralho_anki':
+        _, detalhes['cartas_novas'], detalhes['total_cartas'] = criar_baralho_anki(
+            df, audio_dir, BARALHO, DECK_ID, MODEL_ID, pasta=saida
+        )
+    elif etapa == 'gerar_baralho_em_fluxo':
+        # Síntese + pacote sobrepostos: comparar com criar_audios + gerar_links_audios + criar_baralho_anki
+        _, detalhes['cartas_novas'], detalhes['total_cartas'] = gerar_baralho_em_fluxo(
+            df, BARALHO, DECK_ID, MODEL_ID, cache=False, backend=backend, pasta=saida
+        )
+    elif etapa == 'extrair_cartas_existentes':
+        detalhes['cartas'] = len(extrair_cartas_existentes(apkg_existente))
+    elif etapa == 'extrair_audios_existentes':
+        detalhes['audios'] = len(extrair_audios_existentes(apkg_existente))
+    elif etapa == 'preparar_existente':
+        df = carregar_planilha(os.path.join(diretorio, 'existente.csv'))
+        pasta_audios = criar_audios(df, f"Audios_{BARALHO}_existente", cache=False, backend=backend)
+        df = gerar_links_audios(df, pasta_audios, planilha, BARALHO, backend=backend)
+        criar_baralho_anki(df, pasta_audios, BARALHO, DECK_ID, MODEL_ID,
+                           pasta=os.path.join(diretorio, 'existente'))
+    else:
+        raise ValueError(f"Etapa desconhecida: {etapa}")
+
+    segundos = time.perf_counter() - inicio
+    escrita_fim = _bytes_gravados()
+    return {
+        'etapa': etapa,
+        'segundos': round(segundos, 3),
+        'rss_base_mb': rss_base,
+        'rss_pico_mb': _rss_pico_mb(),
+        'escrita_mb': round((escrita_fim - escrita_inicio) / (1024 * 1024), 1)
+                      if escrita_inicio is not None else None,
+        **detalhes,
+    }
+
+
+def medir_etapa(etapa, diretorio):
+    """
+    Roda uma etapa em um subprocesso novo, para que o pico de RSS e os bytes
+    gravados sejam só dela.
+
+    Args:
+        etapa: Nome da etapa (ver ETAPAS)
+        diretorio: Pasta de trabalho do tamanho sendo medido
+
+    Returns:
+        Dict com segundos, rss_base_mb, rss_pico_mb, escrita_mb e detalhes da etapa
+    """
+    env = dict(os.environ)
+    # Pastas temporárias (áudios, merges) ficam dentro da pasta de trabalho
+    env['TMPDIR'] = env['TEMP'] = env['TMP'] = os.path.join(diretorio, 'tmp')
+    env['ANKI_TTS_BACKEND'] = 'fake'
+    resultado = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--etapa', etapa, '--diretorio', diretorio],
+        cwd=diretorio, env=env, capture_output=True, text=True
+    )
+    if resultado.returncode != 0:
+        raise RuntimeError(f"Etapa {etapa} falhou:\n{resultado.stderr}")
+    return json.loads(resultado.stdout.strip().splitlines()[-1])
+
+
+def rodar(linhas, existentes, etapas, diretorio_base):
+    """
+    Prepara os dados sintéticos de um tamanho e mede as etapas.
+
+    Args:
+        linhas: Número de linhas da planilha
+        existentes: Fração das linhas que já está no baralho existente (0 = sem baralho)
+        etapas: Etapas a medir
+        diretorio_base: Pasta onde os dados do benchmark são gerados
+
+    Returns:
+        Lista de dicts de medição, um por etapa
+    """
+    diretorio = os.path.join(diretorio_base, str(linhas))
+    shutil.rmtree(diretorio, ignore_errors=True)
+    os.makedirs(os.path.join(diretorio, 'tmp'))
+    os.makedirs(os.path.join(diretorio, 'existente'))
+
+    gerar_planilha(os.path.join(diretorio, 'planilha.csv'), linhas)
+    cartas_existentes = int(linhas * existentes)
+    if cartas_existentes:
+        # O baralho existente tem metade das cartas em comum com a planilha e metade só dele
+        gerar_planilha(os.path.join(diretorio, 'existente.csv'), cartas_existentes,
+                       inicio=linhas - cartas_existentes // 2)
+        print(f"🛠️  {linhas} linhas: preparando baralho existente com {cartas_existentes} cartas...")
+        medir_etapa('preparar_existente', diretorio)
+
+    medicoes = []
+    for etapa in etapas:
+        if etapa.startswith('extrair_') and not cartas_existentes:
+            continue
+        medicao = medir_etapa(etapa, diretorio)
+        medicao['linhas'] = linhas
+        medicoes.append(medicao)
+        print(f"⏱️  {linhas:>7} {etapa:<26} {medicao['segundos']:>9.3f}s "
+              f"{medicao['rss_pico_mb'] or 0:>8.1f} MB RSS {medicao['escrita_mb'] or 0:>9.1f} MB gravados")
+    return medicoes
+
+
+def versao_codigo():
+    """Commit atual do repositório, se disponível."""
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def comparar(atual, anterior):
+    """Imprime a variação de tempo e memória de cada etapa em relação a outro resultado."""
+    antes = {(m['linhas'], m['etapa']): m for m in anterior['resultados']}
+    print(f"\n📊 Comparação com {anterior.get('versao') or 'resultado anterior'}:")
+    for medicao in atual['resultados']:
+        base = antes.get((medicao['linhas'], medicao['etapa']))
+        if not base:
+            continue
+        variacoes = []
+        for campo, unidade in (('segundos', 's'), ('rss_pico_mb', ' MB'), ('escrita_mb', ' MB')):
+            if medicao.get(campo) is None or base.get(campo) is None:
+                continue
+            delta = (medicao[campo] - base[campo]) / base[campo] * 100 if base[campo] else 0.0
+            variacoes.append(f"{campo} {base[campo]}{unidade} → {medicao[campo]}{unidade} ({delta:+.0f}%)")
+        print(f"  {medicao['linhas']:>7} {medicao['etapa']:<26} " + ', '.join(variacoes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline de baralhos com dados sintéticos.")
+    parser.add_argument('--linhas', type=int, nargs='+', default=[1000, 10000],
+                        help="Tamanhos de planilha a medir (padrão: 1000 10000)")
+    parser.add_argument('--existentes', type=float, default=0.5,
+                        help="Tamanho do baralho existente como fração das linhas (padrão: 0.5)")
+    parser.add_argument('--etapas', nargs='+', choices=ETAPAS, default=ETAPAS, help="Etapas a medir (cada uma usa os arquivos gravados pelas anteriores)")
+    parser.add_argument('--dados', default=None, help="Pasta para os dados sintéticos (padrão: temporária)")
+    parser.add_argument('--saida', default=None, help="Arquivo JSON dos resultados (padrão: benchmark_<data>.json)")
+    parser.add_argument('--comparar', default=None, help="Resultado JSON anterior para comparação")
+    parser.add_argument('--etapa', help=argparse.SUPPRESS)
+    parser.add_argument('--diretorio', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # Modo interno: uma etapa dentro do subprocesso de medição
+    if args.etapa:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        print(json.dumps(_executar_etapa(args.etapa, args.diretorio)))
+        return 0
+
+    diretorio_base = args.dados or tempfile.mkdtemp(prefix='anki_benchmark_')
+    try:
+        resultados = []
+        for linhas in args.linhas:
+            resultados.extend(rodar(linhas, args.existentes, args.etapas, diretorio_base))
+    finally:
+        if not args.dados:
+            shutil.rmtree(diretorio_base, ignore_errors=True)
+
+    relatorio = {
+        'versao': versao_codigo(),
+        'data': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parametros': {'linhas': args.linhas, 'existentes': args.existentes},
+        'resultados': resultados,
+    }
+    saida = args.saida or f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(saida, 'w', encoding='utf-8') as f:
+        json.dump(relatorio, f, indent=2, ensure_ascii=False)
+    print(f"💾 Resultados salvos em {saida}")
+
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            comparar(relatorio, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""
+Geração de baralhos em lote, sem a interface do Streamlit.
+
+Cada planilha vira um baralho: leitura -> gerar_baralho_em_fluxo, que grava
+cada áudio no pacote assim que ele é sintetizado. Os baralhos são distribuídos entre processos, e todas as
+sínteses de voz dividem um único orçamento de requisições simultâneas.
+
+Uso:
+    python cli.py planilhas/ --saida baralhos/ --processos 4 --tts-simultaneos 8
+    python cli.py lote.json --backend local
+
+O lote .json é uma lista de objetos {"planilha": "...", "baralho": "..."}; o
+nome do baralho é opcional (padrão: nome do arquivo) e caminhos relativos são
+resolvidos a partir da pasta do lote.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ingest import FORMATOS, carregar_planilha
+from metrics import metricas, span
+from tts import LimitadorCompartilhado, TTS_MAX_WORKERS
+from utils import gerar_baralho_em_fluxo
+
+
+# Mesmo modelo de nota usado pelo app, para que os baralhos compartilhem o tipo de nota no Anki
+MODEL_ID = 1607392319
+
+# Limitador de cada processo worker (criado em _iniciar_worker)
+_limitador = None
+
+
+def id_baralho(deck_name):
+    """
+    Gera um ID estável para o baralho a partir do nome.
+
+    Baralhos diferentes precisam de IDs diferentes, senão o Anki junta todos
+    em um só ao importar.
+
+    Args:
+        deck_name: Nome do baralho
+
+    Returns:
+        Inteiro entre 2^30 e 2^31
+    """
+    digest = hashlib.sha256(deck_name.encode('utf-8')).digest()
+    return (1 << 30) + int.from_bytes(digest[:4], 'big') % (1 << 30)
+
+
+def listar_planilhas(entrada):
+    """
+    Lista as planilhas a processar.
+
+    Args:
+        entrada: Pasta com planilhas ou arquivo .json de lote
+
+    Returns:
+        Lista de tuplas (caminho da planilha, nome do baralho), das maiores para
+        as menores, para que os baralhos longos comecem primeiro
+    """
+    if os.path.isdir(entrada):
+        planilhas = [
+            (os.path.join(entrada, nome), os.path.splitext(nome)[0])
+            for nome in sorted(os.listdir(entrada))
+            if os.path.splitext(nome)[1].lower() in FORMATOS and not nome.startswith('~$')
+        ]
+    else:
+        with open(entrada, 'r', encoding='utf-8') as f:
+            lote = json.load(f)
+        base = os.path.dirname(os.path.abspath(entrada))
+        planilhas = []
+        for item in lote:
+            caminho = os.path.join(base, item['planilha'])
+            planilhas.append((caminho, item.get('baralho') or os.path.splitext(os.path.basename(caminho))[0]))
+
+    nomes = [baralho for _, baralho in planilhas]
+    repetidos = {nome for nome in nomes if nomes.count(nome) > 1}
+    if repetidos:
+        raise ValueError(f"Nomes de baralho repetidos no lote: {', '.join(sorted(repetidos))}")
+
+    return sorted(planilhas, key=lambda planilha: os.path.getsize(planilha[0]), reverse=True)
+
+
+def _iniciar_worker(semaforo, tts_por_processo, trace_path=None):
+    global _limitador
+    _limitador = LimitadorCompartilhado(semaforo, tts_por_processo)
+    metricas.trace_path = trace_path
+    # Com fork o worker herda a configuração do pai; force=True troca o formato para incluir o PID
+    logging.basicConfig(level=logging.INFO, format="[%(process)d] %(message)s", force=True)
+
+
+def gerar_baralho(planilha, deck_name, saida, speed=1.0, backend=None, tts_por_processo=TTS_MAX_WORKERS):
+    """
+    Gera (ou atualiza) o baralho de uma planilha. Executado nos processos worker.
+
+    Args:
+        planilha: Caminho da planilha
+        deck_name: Nome do baralho
+        saida: Pasta onde o .apkg é gravado
+        speed: Velocidade da fala
+        backend: Nome do backend de TTS
+        tts_por_processo: Máximo de sínteses simultâneas deste baralho
+
+    Returns:
+        Dict com planilha, baralho, caminho do .apkg, cartas novas, total de cartas,
+        segundos e as métricas do baralho (metricas.snapshot())
+    """
+    # Cada worker processa vários baralhos; as métricas voltam por baralho para o processo principal
+    metricas.resetar()
+    inicio = time.time()
+    with span('baralho', baralho=deck_name, planilha=os.path.basename(planilha)):
+        df = carregar_planilha(planilha)
+
+        # Os áudios vão direto para o pacote conforme são sintetizados, sem pasta de áudios
+        apkg_path, cartas_novas, total_cartas = gerar_baralho_em_fluxo(
+            df,
+            deck_name,
+            id_baralho(deck_name),
+            MODEL_ID,
+            speed=speed,
+            max_workers=tts_por_processo,
+            backend=backend,
+            limitador=_limitador,
+            pasta=saida
+        )
+
+    return {
+        'planilha': planilha,
+        'baralho': deck_name,
+        'apkg': apkg_path,
+        'cartas_novas': cartas_novas,
+        'total_cartas': total_cartas,
+        'segundos': round(time.time() - inicio, 2),
+        'metricas': metricas.snapshot(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera baralhos Anki em lote a partir de planilhas.")
+    parser.add_argument('entrada', help="Pasta com planilhas (.xlsx, .xls, .csv, .parquet) ou lote .json")
+    parser.add_argument('--saida', default='.', help="Pasta dos baralhos gerados (padrão: pasta atual)")
+    parser.add_argument('--processos', type=int, default=os.cpu_count() or 1,
+                        help="Baralhos gerados ao mesmo tempo (padrão: número de CPUs)")
+    parser.add_argument('--tts-simultaneos', type=int, default=TTS_MAX_WORKERS,
+                        help="Sínteses simultâneas somando todos os processos (padrão: %(default)s)")
+    parser.add_argument('--velocidade', type=float, default=1.0, help="Velocidade da fala (padrão: 1.0)")
+    parser.add_argument('--backend', default=None, help="Backend de TTS: gtts, local ou fake")
+    parser.add_argument('--trace', default=None, help="Arquivo JSON-lines com o tempo de cada etapa de cada baralho")
+    parser.add_argument('--metricas', default=None, help="Arquivo com as métricas do lote no formato do Prometheus")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    trace_path = os.path.abspath(args.trace) if args.trace else None
+
+    planilhas = listar_planilhas(args.entrada)
+    if not planilhas:
+        print(f"⚠️ Nenhuma planilha encontrada em {args.entrada}")
+        return 1
+
+    os.makedirs(args.saida, exist_ok=True)
+    saida = os.path.abspath(args.saida)
+    processos = max(1, min(args.processos, len(planilhas)))
+    tts_simultaneos = max(1, args.tts_simultaneos)
+    semaforo = multiprocessing.Semaphore(tts_simultaneos)
+
+    print(f"📚 {len(planilhas)} planilhas, {processos} processos, {tts_simultaneos} sínteses simultâneas")
+    inicio = time.time()
+    falhas = 0
+    with ProcessPoolExecutor(max_workers=processos, initializer=_iniciar_worker,
+                             initargs=(semaforo, min(TTS_MAX_WORKERS, tts_simultaneos), trace_path)) as executor:
+        futures = {
+            executor.submit(gerar_baralho, planilha, deck_name, saida, args.velocidade, args.backend,
+                            min(TTS_MAX_WORKERS, tts_simultaneos)): deck_name
+            for planilha, deck_name in planilhas
+        }
+        for future in as_completed(futures):
+            try:
+                resultado = future.result()
+            except Exception as e:
+                falhas += 1
+                print(f"❌ {futures[future]}: {str(e)}")
+                continue
+            metricas.mesclar(resultado['metricas'])
+            print(f"✅ {resultado['baralho']}: {resultado['cartas_novas']} cartas novas "
+                  f"({resultado['total_cartas']} no total) em {resultado['segundos']}s")
+
+    print(f"🏁 {len(planilhas) - falhas}/{len(planilhas)} baralhos gerados em {time.time() - inicio:.1f}s")
+
+    if args.metricas:
+        metricas.contar('baralhos_gerados', len(planilhas) - falhas)
+        metricas.contar('baralhos_com_erro', falhas)
+        with open(args.metricas, 'w', encoding='utf-8') as f:
+            f.write(metricas.exportar_prometheus())
+        print(f"📈 Métricas salvas em {args.metricas}")
+    return 1 if falhas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
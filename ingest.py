@@ -0,0 +1,191 @@
+import os
+import itertools
+import pandas as pd
+from metrics import contar, span
+
+
+# Linhas por lote na leitura das planilhas
+TAMANHO_LOTE = 10000
+
+# Formatos aceitos (extensão -> formato)
+FORMATOS = {
+    '.xlsx': 'xlsx',
+    '.xlsm': 'xlsx',
+    '.xls': 'xls',
+    '.csv': 'csv',
+    '.txt': 'csv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+}
+
+# Nomes das colunas conforme a quantidade de colunas da planilha
+COLUNAS_POR_LARGURA = {
+    2: ['Word', 'Context'],
+    3: ['Word', 'Translation', 'Context'],
+    4: ['Word', 'Translation', 'Phonetic', 'Context'],
+}
+
+
+def detectar_formato(nome):
+    """
+    Identifica o formato da planilha pela extensão do arquivo.
+
+    Args:
+        nome: Nome ou caminho do arquivo
+
+    Returns:
+        'xlsx', 'xls', 'csv' ou 'parquet'
+    """
+    extensao = os.path.splitext(str(nome))[1].lower()
+    if extensao not in FORMATOS:
+        raise ValueError(f"Formato de arquivo não suportado: {extensao or nome}")
+    return FORMATOS[extensao]
+
+
+def normalizar_colunas(df):
+    """
+    Identifica as colunas pela posição e as renomeia para Word/Translation/Phonetic/Context.
+
+    Com 4 ou mais colunas: Word | Translation | Phonetic | Context (as demais são ignoradas)
+    Com 3 colunas: Word | Translation | Context
+    Com 2 colunas: Word | Context
+
+    Args:
+        df: DataFrame lido da planilha
+
+    Returns:
+        DataFrame só com as colunas reconhecidas
+    """
+    largura = min(len(df.columns), 4)
+    if largura < 2:
+        raise ValueError("O arquivo deve ter pelo menos 2 colunas")
+
+    df_renamed = df.iloc[:, list(range(largura))].copy()
+    df_renamed.columns = COLUNAS_POR_LARGURA[largura]
+    return df_renamed
+
+
+def ler_planilha_em_lotes(fonte, nome=None, tamanho_lote=TAMANHO_LOTE):
+    """
+    Lê uma planilha em lotes de linhas, já com as colunas normalizadas.
+
+    Arquivos .xlsx são lidos em modo streaming (read_only do openpyxl), CSV com
+    chunksize do pandas e Parquet em record batches (requer pyarrow). Arquivos .xls
+    antigos não têm leitura em streaming e são lidos de uma vez.
+
+    Args:
+        fonte: Caminho do arquivo ou objeto file-like (ex.: upload do Streamlit)
+        nome: Nome do arquivo, para detectar o formato (padrão: o próprio caminho)
+        tamanho_lote: Número de linhas por lote
+
+    Yields:
+        DataFrames com colunas Word, Translation/Phonetic (se houver) e Context
+    """
+    formato = detectar_formato(nome or getattr(fonte, 'name', fonte))
+    if hasattr(fonte, 'seek'):
+        fonte.seek(0)
+
+    if formato == 'xlsx':
+        lotes = _ler_xlsx(fonte, tamanho_lote)
+    elif formato == 'csv':
+        lotes = _ler_csv(fonte, tamanho_lote)
+    elif formato == 'parquet':
+        lotes = _ler_parquet(fonte, tamanho_lote)
+    else:
+        lotes = [pd.read_excel(fonte)]
+
+    for lote in lotes:
+        # Linhas totalmente vazias (comuns no fim das planilhas) são descartadas
+        lote = normalizar_colunas(lote).dropna(how='all')
+        if len(lote):
+            yield lote
+
+
+def carregar_planilha(fonte, nome=None, tamanho_lote=TAMANHO_LOTE):
+    """
+    Lê a planilha inteira (em lotes) e retorna um único DataFrame normalizado.
+
+    Args:
+        fonte: Caminho do arquivo ou objeto file-like
+        nome: Nome do arquivo, para detectar o formato
+        tamanho_lote: Número de linhas por lote
+
+    Returns:
+        DataFrame com colunas Word, Translation/Phonetic (se houver) e Context
+    """
+    with span('ingestao') as atributos:
+        lotes = list(ler_planilha_em_lotes(fonte, nome, tamanho_lote))
+        if not lotes:
+            raise ValueError("O arquivo está vazio")
+        df = pd.concat(lotes, ignore_index=True)
+        atributos.update(linhas=len(df), lotes=len(lotes))
+    contar('linhas_lidas', len(df))
+    return df
+
+
+def _ler_xlsx(fonte, tamanho_lote):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(fonte, read_only=True, data_only=True)
+    try:
+        linhas = workbook.active.iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        # Células vazias com estilo entram em iter_rows: como o leitor do pandas,
+        # as células vazias no fim de cada linha são descartadas. A largura é a
+        # do cabeçalho ou da linha mais larga do primeiro lote (uma coluna sem
+        # título vira "Unnamed: i") e vale para todos os lotes, que assim são
+        # normalizados do mesmo jeito
+        cabecalho = _sem_vazias_no_fim(cabecalho)
+        primeiro_lote = [_sem_vazias_no_fim(linha) for linha in itertools.islice(linhas, tamanho_lote)]
+        largura = max([len(cabecalho)] + [len(linha) for linha in primeiro_lote])
+        colunas = [str(c) if c is not None else f"Unnamed: {i}"
+                   for i, c in enumerate(cabecalho + (None,) * (largura - len(cabecalho)))]
+
+        lote = []
+        for linha in itertools.chain(primeiro_lote, linhas):
+            lote.append(tuple(linha[:largura]) + (None,) * (largura - len(linha)))
+            if len(lote) >= tamanho_lote:
+                yield pd.DataFrame(lote, columns=colunas)
+                lote = []
+        if lote:
+            yield pd.DataFrame(lote, columns=colunas)
+    finally:
+        workbook.close()
+
+
+def _sem_vazias_no_fim(linha):
+    fim = len(linha)
+    while fim and linha[fim - 1] is None:
+        fim -= 1
+    return tuple(linha[:fim])
+
+
+def _ler_csv(fonte, tamanho_lote):
+    yield from pd.read_csv(fonte, sep=_detectar_separador(fonte), chunksize=tamanho_lote)
+
+
+def _detectar_separador(fonte):
+    """Escolhe entre vírgula, ponto e vírgula e tab pela primeira linha do CSV."""
+    if hasattr(fonte, 'read'):
+        posicao = fonte.tell()
+        primeira_linha = fonte.readline()
+        fonte.seek(posicao)
+    else:
+        with open(fonte, 'rb') as f:
+            primeira_linha = f.readline()
+    if isinstance(primeira_linha, bytes):
+        primeira_linha = primeira_linha.decode('utf-8', errors='ignore')
+    return max([',', ';', '\t'], key=primeira_linha.count)
+
+
+def _ler_parquet(fonte, tamanho_lote):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Leitura de Parquet requer o pacote pyarrow (pip install pyarrow)")
+
+    arquivo = pq.ParquetFile(fonte)
+    for batch in arquivo.iter_batches(batch_size=tamanho_lote):
+        yield batch.to_pandas()
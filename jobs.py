@@ -0,0 +1,158 @@
+import time
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Número de jobs executados ao mesmo tempo pelo gerenciador
+JOBS_MAX_WORKERS = 4
+
+# Tempo (segundos) que um job finalizado continua disponível para consulta
+JOBS_RETENCAO = 60 * 60
+
+
+class Job:
+    """
+    Um trabalho executado em segundo plano, com progresso e cancelamento.
+
+    A função do job recebe o próprio Job como primeiro argumento e deve chamar
+    job.progresso(concluidos, total) conforme avança e consultar job.cancelado
+    (ou passar job.evento_cancelar adiante) para parar cedo.
+    """
+
+    def __init__(self, descricao='', chave=None):
+        self.id = uuid.uuid4().hex
+        self.descricao = descricao
+        self.chave = chave
+        self.status = 'pendente'
+        self.total = 0
+        self.concluidos = 0
+        self.resultado = None
+        self.erro = None
+        self.criado = time.time()
+        self.inicio = None
+        self.fim = None
+        self.evento_cancelar = threading.Event()
+        self._lock = threading.Lock()
+
+    def progresso(self, concluidos, total=None):
+        """
+        Atualiza o progresso do job.
+
+        Args:
+            concluidos: Itens concluídos até agora
+            total: Total de itens (opcional, mantém o anterior)
+        """
+        with self._lock:
+            self.concluidos = concluidos
+            if total is not None:
+                self.total = total
+
+    def cancelar(self):
+        """Solicita o cancelamento; o job para no próximo ponto de verificação."""
+        self.evento_cancelar.set()
+
+    @property
+    def cancelado(self):
+        return self.evento_cancelar.is_set()
+
+    @property
+    def finalizado(self):
+        return self.status in ('concluido', 'erro', 'cancelado')
+
+    def velocidade(self):
+        """Itens por segundo desde o início do job."""
+        if not self.inicio:
+            return 0.0
+        decorrido = (self.fim or time.time()) - self.inicio
+        return self.concluidos / decorrido if decorrido > 0 else 0.0
+
+    def eta(self):
+        """Segundos estimados até o fim, ou None se ainda não há como estimar."""
+        velocidade = self.velocidade()
+        if velocidade <= 0 or not self.total:
+            return None
+        return max(0.0, (self.total - self.concluidos) / velocidade)
+
+    def _executar(self, funcao, args, kwargs):
+        self.status = 'executando'
+        self.inicio = time.time()
+        try:
+            self.resultado = funcao(self, *args, **kwargs)
+            self.status = 'concluido'
+        except Exception as e:
+            # Quem para por cancelamento lança o erro que quiser (ex.: InterruptedError)
+            self.erro = e
+            self.status = 'cancelado' if self.cancelado else 'erro'
+        finally:
+            self.fim = time.time()
+
+
+class GerenciadorJobs:
+    """
+    Executa jobs em um pool de threads que vive fora das reexecuções do script
+    do Streamlit (guardado com st.cache_resource), então o servidor continua
+    respondendo e o trabalho sobrevive a um refresh do navegador.
+    """
+
+    def __init__(self, max_workers=JOBS_MAX_WORKERS, retencao=JOBS_RETENCAO):
+        """
+        Args:
+            max_workers: Número de jobs executados ao mesmo tempo
+            retencao: Segundos que um job finalizado continua disponível
+        """
+        self.retencao = retencao
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submeter(self, funcao, *args, descricao='', chave=None, **kwargs):
+        """
+        Agenda funcao(job, *args, **kwargs) para execução em segundo plano.
+
+        Se chave for informada e já houver um job em andamento com a mesma chave,
+        ele é retornado em vez de iniciar outro (ex.: a mesma planilha enviada de
+        novo após um refresh; o app inclui a área de trabalho na chave, então outras
+        sessões não o adotam).
+
+        Returns:
+            Job criado ou reaproveitado (use job.id para consultá-lo depois)
+        """
+        with self._lock:
+            self._remover_expirados()
+            if chave is not None:
+                ativo = self._ativo(chave)
+                if ativo is not None:
+                    return ativo
+            job = Job(descricao, chave)
+            self._jobs[job.id] = job
+        self._executor.submit(job._executar, funcao, args, kwargs)
+        return job
+
+    def obter(self, job_id):
+        """
+        Returns:
+            Job com esse id, ou None se não existir (ou já tiver expirado)
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def ativo(self, chave):
+        """
+        Returns:
+            Job em andamento com essa chave, ou None
+        """
+        with self._lock:
+            return self._ativo(chave)
+
+    def _ativo(self, chave):
+        for job in self._jobs.values():
+            if job.chave == chave and not job.finalizado:
+                return job
+        return None
+
+    def _remover_expirados(self):
+        agora = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finalizado and agora - job.fim > self.retencao:
+                del self._jobs[job_id]
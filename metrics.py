@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+
+# Prefixo das métricas na exportação no formato do Prometheus
+PREFIXO = 'anki'
+
+logger = logging.getLogger(__name__)
+
+
+class Metricas:
+    """
+    Registro de contadores e tempos por etapa do pipeline.
+
+    Contadores são identificados por nome e labels (ex.: cache_hits,
+    backend='gtts'). Cada span registra a duração de uma etapa (contagem,
+    soma e máximo, por nome) e, se houver um arquivo de trace configurado,
+    grava uma linha JSON com o início, a duração e os atributos do span.
+    """
+
+    def __init__(self, trace_path=None):
+        """
+        Args:
+            trace_path: Arquivo JSON-lines para o trace dos spans (opcional)
+        """
+        self.trace_path = trace_path
+        self._contadores = {}
+        self._etapas = {}
+        self._lock = threading.Lock()
+
+    def contar(self, nome, valor=1, **labels):
+        """
+        Incrementa um contador.
+
+        Args:
+            nome: Nome do contador (ex.: 'tts_chamadas')
+            valor: Quanto somar
+            **labels: Labels do contador (ex.: backend='gtts')
+        """
+        chave = (nome, tuple(sorted(labels.items())))
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    @contextmanager
+    def span(self, nome, **atributos):
+        """
+        Mede a duração de um bloco como uma etapa do pipeline.
+
+        Atributos podem ser acrescentados dentro do bloco pelo dict retornado
+        (ex.: span['linhas'] = len(df)) e vão para o trace.
+
+        Args:
+            nome: Nome da etapa (ex.: 'sintese')
+            **atributos: Atributos do span para o trace
+        """
+        inicio_relogio = time.time()
+        inicio = time.perf_counter()
+        erro = None
+        try:
+            yield atributos
+        except BaseException as e:
+            erro = e
+            raise
+        finally:
+            segundos = time.perf_counter() - inicio
+            with self._lock:
+                contagem, soma, maximo = self._etapas.get(nome, (0, 0.0, 0.0))
+                self._etapas[nome] = (contagem + 1, soma + segundos, max(maximo, segundos))
+            logger.debug("%s: %.3fs %s", nome, segundos, atributos)
+            if self.trace_path:
+                self._gravar_trace({
+                    'span': nome,
+                    'inicio': round(inicio_relogio, 6),
+                    'segundos': round(segundos, 6),
+                    'pid': os.getpid(),
+                    'thread': threading.current_thread().name,
+                    'erro': repr(erro) if erro is not None else None,
+                    **atributos,
+                })
+
+    def _gravar_trace(self, registro):
+        linha = json.dumps(registro, ensure_ascii=False, default=str) + '\n'
+        try:
+            # Uma escrita por linha em modo append: processos paralelos não misturam linhas
+            with open(self.trace_path, 'a', encoding='utf-8') as f:
+                f.write(linha)
+        except OSError as e:
+            logger.warning("Erro ao gravar trace: %s", e)
+
+    def snapshot(self):
+        """
+        Returns:
+            Dict serializável com os contadores e etapas registrados até agora
+        """
+        with self._lock:
+            return {
+                'contadores': [[nome, dict(labels), valor] for (nome, labels), valor in self._contadores.items()],
+                'etapas': {nome: list(valores) for nome, valores in self._etapas.items()},
+            }
+
+    def mesclar(self, snapshot):
+        """
+        Soma ao registro um snapshot de outro processo (ex.: workers do cli.py).
+
+        Args:
+            snapshot: Dict retornado por snapshot()
+        """
+        for nome, labels, valor in snapshot['contadores']:
+            self.contar(nome, valor, **labels)
+        with self._lock:
+            for nome, (contagem, soma, maximo) in snapshot['etapas'].items():
+                atual = self._etapas.get(nome, (0, 0.0, 0.0))
+                self._etapas[nome] = (atual[0] + contagem, atual[1] + soma, max(atual[2], maximo))
+
+    def resetar(self):
+        """Zera contadores e etapas."""
+        with self._lock:
+            self._contadores.clear()
+            self._etapas.clear()
+
+    def exportar_prometheus(self):
+        """
+        Exporta as métricas no formato de texto do Prometheus.
+
+        Returns:
+            String com os contadores (anki_<nome>_total) e o resumo de tempo por etapa
+            (anki_etapa_segundos_count/_sum e anki_etapa_segundos_max)
+        """
+        snapshot = self.snapshot()
+        linhas = []
+
+        contadores = {}
+        for nome, labels, valor in snapshot['contadores']:
+            contadores.setdefault(nome, []).append((labels, valor))
+        for nome in sorted(contadores):
+            metrica = f"{PREFIXO}_{nome}_total"
+            linhas.append(f"# TYPE {metrica} counter")
+            for labels, valor in sorted(contadores[nome], key=lambda item: sorted(item[0].items())):
+                linhas.append(f"{metrica}{_formatar_labels(labels)} {valor}")
+
+        if snapshot['etapas']:
+            metrica = f"{PREFIXO}_etapa_segundos"
+            linhas.append(f"# TYPE {metrica} summary")
+            for nome in sorted(snapshot['etapas']):
+                contagem, soma, _ = snapshot['etapas'][nome]
+                linhas.append(f"{metrica}_count{_formatar_labels({'etapa': nome})} {contagem}")
+                linhas.append(f"{metrica}_sum{_formatar_labels({'etapa': nome})} {soma:.6f}")
+            linhas.append(f"# TYPE {metrica}_max gauge")
+            for nome in sorted(snapshot['etapas']):
+                maximo = snapshot['etapas'][nome][2]
+                linhas.append(f"{metrica}_max{_formatar_labels({'etapa': nome})} {maximo:.6f}")
+
+        return '\n'.join(linhas) + '\n' if linhas else ''
+
+
+def _formatar_labels(labels):
+    if not labels:
+        return ''
+    pares = ','.join(
+        '{}="{}"'.format(chave, str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for chave, valor in sorted(labels.items())
+    )
+    return '{' + pares + '}'
+
+
+# Registro padrão do processo; o trace é ligado com ANKI_TRACE_FILE
+metricas = Metricas(os.environ.get('ANKI_TRACE_FILE') or None)
+
+
+def span(nome, **atributos):
+    """Mede uma etapa no registro padrão (ver Metricas.span)."""
+    return metricas.span(nome, **atributos)
+
+
+def contar(nome, valor=1, **labels):
+    """Incrementa um contador no registro padrão (ver Metricas.contar)."""
+    metricas.contar(nome, valor, **labels)
+
+
+def exportar_prometheus():
+    """Exporta o registro padrão no formato de texto do Prometheus."""
+    return metricas.exportar_prometheus()
@@ -0,0 +1,876 @@
+import os
+import hashlib
+import io
+import json
+import logging
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+from gtts import gTTS
+from metrics import contar
+
+
+# Tamanho máximo padrão do cache de áudios (em bytes)
+CACHE_TAMANHO_MAXIMO = 512 * 1024 * 1024
+
+# Fração do limite a que a evicção reduz o cache, para não varrer a pasta a cada áudio novo
+CACHE_FRACAO_APOS_EVICCAO = 0.9
+
+# Concorrência e tentativas padrão da síntese
+TTS_MAX_WORKERS = 8
+TTS_TENTATIVAS = 4
+TTS_ESPERA_BASE = 0.5
+
+# Backend usado quando nenhum é informado
+TTS_BACKEND_PADRAO = 'gtts'
+
+# Nome do manifesto de síntese gravado na pasta dos áudios
+MANIFESTO_NOME = 'manifesto.jsonl'
+
+logger = logging.getLogger(__name__)
+
+
+class CacheAudio:
+    """
+    Cache persistente em disco para áudios TTS, endereçado por conteúdo.
+
+    Cada áudio é guardado com o nome do hash de (texto, idioma, slow, backend),
+    então o mesmo texto sintetizado para outro baralho (ou em um novo upload)
+    é servido direto do disco. Quando o tamanho total passa do limite, os
+    arquivos usados há mais tempo (mtime) são removidos primeiro.
+    """
+
+    def __init__(self, diretorio=None, tamanho_maximo=CACHE_TAMANHO_MAXIMO):
+        """
+        Args:
+            diretorio: Pasta do cache (padrão: pasta temporária do sistema)
+            tamanho_maximo: Tamanho máximo do cache em bytes
+        """
+        self.diretorio = diretorio or os.path.join(tempfile.gettempdir(), 'anki_tts_cache')
+        self.tamanho_maximo = tamanho_maximo
+        self.hits = 0
+        self.misses = 0
+        self.removidos = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.diretorio, exist_ok=True)
+        self._tamanho = sum(tamanho for _, tamanho, _ in self._listar_entradas())
+
+    @staticmethod
+    def chave(texto, lang, slow, backend):
+        """
+        Gera a chave do cache para um áudio.
+
+        Args:
+            texto: Texto sintetizado
+            lang: Idioma do áudio
+            slow: Se a fala é lenta (ou a velocidade usada)
+            backend: Nome do backend de TTS
+
+        Returns:
+            String hexadecimal (sha256) que identifica o áudio
+        """
+        conteudo = json.dumps([str(texto), lang, slow, backend], ensure_ascii=False)
+        return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+
+    def caminho(self, chave):
+        """Caminho do arquivo do cache para a chave."""
+        return os.path.join(self.diretorio, f"{chave}.mp3")
+
+    def obter(self, chave, destino):
+        """
+        Copia o áudio do cache para o destino, se existir.
+
+        Args:
+            chave: Chave gerada por CacheAudio.chave
+            destino: Caminho do arquivo de saída
+
+        Returns:
+            True se o áudio estava no cache, False caso contrário
+        """
+        origem = self.caminho(chave)
+        try:
+            # Atualizar mtime marca a entrada como usada recentemente (LRU)
+            os.utime(origem)
+            _vincular_arquivo(origem, destino)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return False
+
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def obter_bytes(self, chave):
+        """
+        Lê o áudio do cache para a memória, se existir.
+
+        Args:
+            chave: Chave gerada por CacheAudio.chave
+
+        Returns:
+            Bytes do áudio, ou None se não estava no cache
+        """
+        origem = self.caminho(chave)
+        try:
+            os.utime(origem)
+            with open(origem, 'rb') as f:
+                dados = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return dados
+
+    def guardar(self, chave, origem):
+        """
+        Guarda no cache um áudio recém-sintetizado.
+
+        Args:
+            chave: Chave gerada por CacheAudio.chave
+            origem: Caminho do arquivo de áudio gerado
+        """
+        self._gravar(chave, lambda temp_path: shutil.copyfile(origem, temp_path))
+
+    def guardar_bytes(self, chave, dados):
+        """
+        Guarda no cache um áudio sintetizado para a memória.
+
+        Args:
+            chave: Chave gerada por CacheAudio.chave
+            dados: Bytes do áudio
+        """
+        def escrever(temp_path):
+            with open(temp_path, 'wb') as f:
+                f.write(dados)
+
+        self._gravar(chave, escrever)
+
+    def _gravar(self, chave, escrever):
+        destino = self.caminho(chave)
+        temp_path = None
+        try:
+            # Gravar em um arquivo temporário e renomear evita entradas pela metade
+            fd, temp_path = tempfile.mkstemp(dir=self.diretorio, suffix='.tmp')
+            os.close(fd)
+            escrever(temp_path)
+            tamanho_novo = os.path.getsize(temp_path)
+            with self._lock:
+                # Regravar uma chave existente só soma a diferença de tamanho
+                try:
+                    tamanho_antigo = os.path.getsize(destino)
+                except OSError:
+                    tamanho_antigo = 0
+                os.replace(temp_path, destino)
+                self._tamanho += tamanho_novo - tamanho_antigo
+                excedeu = self._tamanho > self.tamanho_maximo
+        except OSError as e:
+            logger.warning("⚠️ Erro ao guardar áudio no cache: %s", e)
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        if excedeu:
+            self.evictar()
+
+    def evictar(self):
+        """
+        Remove as entradas usadas há mais tempo até o cache ocupar
+        CACHE_FRACAO_APOS_EVICCAO do limite, deixando folga para os próximos áudios.
+        """
+        alvo = self.tamanho_maximo * CACHE_FRACAO_APOS_EVICCAO
+        with self._lock:
+            entradas = sorted(self._listar_entradas(), key=lambda entrada: entrada[2])
+            tamanho = sum(tamanho for _, tamanho, _ in entradas)
+
+            for path, tamanho_arquivo, _ in entradas:
+                if tamanho <= alvo:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                tamanho -= tamanho_arquivo
+                self.removidos += 1
+
+            self._tamanho = tamanho
+
+    def estatisticas(self):
+        """
+        Returns:
+            Dict com hits, misses, entradas removidas e tamanho atual em bytes
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'removidos': self.removidos,
+                'tamanho': self._tamanho,
+            }
+
+    def _listar_entradas(self):
+        """Lista (caminho, tamanho, mtime) de cada áudio do cache."""
+        entradas = []
+        with os.scandir(self.diretorio) as it:
+            for entry in it:
+                if entry.name.endswith('.mp3'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entradas.append((entry.path, stat.st_size, stat.st_mtime))
+        return entradas
+
+
+def mp3_valido(path, tamanho=None):
+    """
+    Confere se um arquivo parece um MP3 completo.
+
+    Args:
+        path: Caminho do arquivo
+        tamanho: Tamanho esperado em bytes (opcional, ex.: o registrado no manifesto)
+
+    Returns:
+        True se o arquivo existe, não está vazio, tem o tamanho esperado e começa
+        com uma tag ID3 ou um frame MPEG (ou RIFF/FORM: WAV/AIFF, que é o que o
+        pyttsx3 grava quando não há codificador para MP3)
+    """
+    try:
+        tamanho_atual = os.path.getsize(path)
+        if tamanho_atual == 0 or (tamanho is not None and tamanho_atual != tamanho):
+            return False
+        with open(path, 'rb') as f:
+            cabecalho = f.read(4)
+    except OSError:
+        return False
+    if cabecalho[:3] == b'ID3' or cabecalho in (b'RIFF', b'FORM'):
+        return True
+    return len(cabecalho) >= 2 and cabecalho[0] == 0xFF and cabecalho[1] & 0xE0 == 0xE0
+
+
+class ManifestoSintese:
+    """
+    Registro incremental da síntese de uma pasta de áudios.
+
+    Cada áudio finalizado (ou que falhou) vira uma linha JSON no manifesto,
+    gravada na hora: arquivo, chave do texto, status, bytes e duração da
+    síntese. Se o processo morrer no meio, a próxima execução sabe quais
+    áudios estão prontos e detecta arquivos truncados ou corrompidos (tamanho
+    diferente do registrado ou cabeçalho inválido), que são sintetizados de novo.
+    """
+
+    def __init__(self, diretorio, nome=MANIFESTO_NOME):
+        """
+        Args:
+            diretorio: Pasta dos áudios (o manifesto fica dentro dela)
+            nome: Nome do arquivo do manifesto
+        """
+        self.caminho = os.path.join(diretorio, nome)
+        self.registros = {}
+        self._arquivo = None
+        self._linha_aberta = False
+        self._carregar()
+
+    def _carregar(self):
+        linhas = 0
+        try:
+            with open(self.caminho, 'r', encoding='utf-8') as f:
+                for linha in f:
+                    linhas += 1
+                    self._linha_aberta = not linha.endswith('\n')
+                    try:
+                        registro = json.loads(linha)
+                    except ValueError:
+                        # Última linha pela metade (processo interrompido durante a escrita)
+                        continue
+                    self.registros[registro['arquivo']] = registro
+        except OSError:
+            return
+
+        # O manifesto só cresce; reescrever quando a maior parte das linhas for obsoleta
+        if linhas > 2 * len(self.registros) + 100:
+            self.compactar()
+
+    def registro(self, filename):
+        """
+        Returns:
+            Último registro do áudio, ou None se ele nunca foi registrado
+        """
+        return self.registros.get(os.path.basename(filename))
+
+    def valido(self, filename):
+        """
+        Verifica se um áudio da pasta está pronto e íntegro.
+
+        Args:
+            filename: Caminho do áudio
+
+        Returns:
+            True se o arquivo é um MP3 válido e, quando registrado como concluído,
+            tem o mesmo tamanho gravado no manifesto
+        """
+        registro = self.registro(filename)
+        tamanho = registro['bytes'] if registro and registro['status'] == 'ok' else None
+        return mp3_valido(filename, tamanho)
+
+    def registrar(self, filename, chave, status='ok', duracao=None, erro=None):
+        """
+        Acrescenta um registro ao manifesto e o grava imediatamente.
+
+        Args:
+            filename: Caminho do áudio
+            chave: Chave do texto (CacheAudio.chave)
+            status: 'ok' ou 'erro'
+            duracao: Tempo da síntese em segundos (None para áudios reaproveitados)
+            erro: Mensagem de erro, quando status é 'erro'
+        """
+        registro = {
+            'arquivo': os.path.basename(filename),
+            'chave': chave,
+            'status': status,
+            'bytes': os.path.getsize(filename) if status == 'ok' else 0,
+            'duracao': round(duracao, 3) if duracao is not None else None,
+        }
+        if erro is not None:
+            registro['erro'] = str(erro)
+        self.registros[registro['arquivo']] = registro
+
+        if self._arquivo is None:
+            self._arquivo = open(self.caminho, 'a', encoding='utf-8')
+            if self._linha_aberta:
+                # Fechar a linha deixada pela metade para não corromper o novo registro
+                self._arquivo.write('\n')
+                self._linha_aberta = False
+        self._arquivo.write(json.dumps(registro, ensure_ascii=False) + '\n')
+        self._arquivo.flush()
+
+    def compactar(self):
+        """Reescreve o manifesto só com o último registro de cada áudio."""
+        self.fechar()
+        temp_path = f"{self.caminho}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for registro in self.registros.values():
+                f.write(json.dumps(registro, ensure_ascii=False) + '\n')
+        os.replace(temp_path, self.caminho)
+        self._linha_aberta = False
+
+    def fechar(self):
+        if self._arquivo is not None:
+            self._arquivo.close()
+            self._arquivo = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+
+class LimitadorAdaptativo:
+    """
+    Limita quantas sínteses rodam ao mesmo tempo e se adapta ao backend.
+
+    Segue a estratégia AIMD: quando o backend sinaliza limite de requisições
+    (HTTP 429 e afins) o limite cai pela metade; a cada sequência de sucessos
+    ele volta a subir de um em um, até o máximo configurado.
+    """
+
+    def __init__(self, maximo=TTS_MAX_WORKERS, minimo=1, sucessos_para_subir=10):
+        """
+        Args:
+            maximo: Número máximo de sínteses simultâneas
+            minimo: Número mínimo de sínteses simultâneas
+            sucessos_para_subir: Sucessos seguidos necessários para aumentar o limite
+        """
+        self.maximo = max(1, maximo)
+        self.minimo = max(1, min(minimo, self.maximo))
+        self.sucessos_para_subir = sucessos_para_subir
+        self.limite = self.maximo
+        self.em_uso = 0
+        self.throttles = 0
+        self._sucessos = 0
+        self._cond = threading.Condition()
+
+    def adquirir(self):
+        """Bloqueia até haver uma vaga dentro do limite atual."""
+        with self._cond:
+            while self.em_uso >= self.limite:
+                self._cond.wait()
+            self.em_uso += 1
+
+    def liberar(self, sucesso=True, throttled=False):
+        """
+        Libera a vaga e ajusta o limite conforme o resultado.
+
+        Args:
+            sucesso: Se a síntese deu certo
+            throttled: Se o erro indica limite de requisições do backend
+        """
+        with self._cond:
+            self.em_uso -= 1
+            if throttled:
+                self.throttles += 1
+                self._sucessos = 0
+                self.limite = max(self.minimo, self.limite // 2)
+            elif sucesso:
+                self._sucessos += 1
+                if self._sucessos >= self.sucessos_para_subir and self.limite < self.maximo:
+                    self.limite += 1
+                    self._sucessos = 0
+            self._cond.notify_all()
+
+
+class LimitadorCompartilhado(LimitadorAdaptativo):
+    """
+    LimitadorAdaptativo que também respeita um orçamento global de sínteses.
+
+    O orçamento é um semáforo de multiprocessing criado pelo processo
+    principal e repassado aos workers, então vários processos (um baralho
+    cada) nunca somam mais sínteses simultâneas do que o backend aguenta.
+    O ajuste AIMD continua valendo dentro de cada processo.
+    """
+
+    def __init__(self, semaforo, maximo=TTS_MAX_WORKERS, **kwargs):
+        """
+        Args:
+            semaforo: multiprocessing.Semaphore com o orçamento global
+            maximo: Número máximo de sínteses simultâneas deste processo
+        """
+        super().__init__(maximo, **kwargs)
+        self.semaforo = semaforo
+
+    def adquirir(self):
+        super().adquirir()
+        self.semaforo.acquire()
+
+    def liberar(self, sucesso=True, throttled=False):
+        self.semaforo.release()
+        super().liberar(sucesso, throttled)
+
+
+def sintetizar_concorrente(tarefas, sintetizar, max_workers=TTS_MAX_WORKERS,
+                           tentativas=TTS_TENTATIVAS, espera_base=TTS_ESPERA_BASE,
+                           limitador=None, progresso=None, cancelar=None, ao_finalizar=None):
+    """
+    Executa várias sínteses em paralelo, com novas tentativas e limite adaptativo.
+
+    Args:
+        tarefas: Lista de tuplas (texto, filename)
+        sintetizar: Função sintetizar(texto, filename) que grava um áudio
+        max_workers: Número de threads do pool
+        tentativas: Número máximo de tentativas por áudio
+        espera_base: Espera (segundos) antes da 2ª tentativa; dobra a cada nova tentativa
+        limitador: LimitadorAdaptativo compartilhado (padrão: um novo, com max_workers)
+        progresso: Função progresso(concluidas) chamada a cada tarefa finalizada (opcional)
+        cancelar: threading.Event; quando setado, as tarefas ainda não iniciadas são
+                  descartadas e entram na lista de falhas como CancelledError
+        ao_finalizar: Função ao_finalizar(indice, erro, duracao) chamada na thread que
+                      chamou sintetizar_concorrente assim que cada tarefa termina
+                      (erro é None em caso de sucesso; duracao em segundos)
+
+    Returns:
+        Lista de tuplas (indice_da_tarefa, exceção) das tarefas que falharam
+    """
+    if not tarefas:
+        return []
+
+    if limitador is None:
+        limitador = LimitadorAdaptativo(max_workers)
+
+    def executar(tarefa):
+        texto, filename = tarefa
+        for tentativa in range(tentativas):
+            if cancelar is not None and cancelar.is_set():
+                raise CancelledError()
+            limitador.adquirir()
+            contar('tts_chamadas')
+            inicio = time.perf_counter()
+            try:
+                sintetizar(texto, filename)
+            except Exception as e:
+                throttled = _eh_throttling(e)
+                contar('tts_falhas', throttled=throttled)
+                limitador.liberar(sucesso=False, throttled=throttled)
+                if tentativa == tentativas - 1:
+                    raise
+                # Backoff exponencial com jitter para não sincronizar as threads
+                time.sleep(espera_base * (2 ** tentativa) * (0.5 + random.random()))
+            else:
+                limitador.liberar(sucesso=True)
+                return time.perf_counter() - inicio
+
+    erros = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(executar, tarefa): i for i, tarefa in enumerate(tarefas)}
+        concluidas = 0
+        for future in as_completed(futures):
+            if cancelar is not None and cancelar.is_set():
+                for pendente in futures:
+                    pendente.cancel()
+            erro = CancelledError() if future.cancelled() else future.exception()
+            if erro is not None:
+                erros.append((futures[future], erro))
+            if ao_finalizar:
+                ao_finalizar(futures[future], erro, None if erro is not None else future.result())
+            if not isinstance(erro, CancelledError):
+                concluidas += 1
+                if progresso:
+                    progresso(concluidas)
+
+    return sorted(erros, key=lambda erro: erro[0])
+
+
+def _eh_throttling(erro):
+    """Verifica se a exceção indica limite de requisições do backend."""
+    rsp = getattr(erro, 'rsp', None)
+    status = getattr(rsp, 'status_code', None)
+    if status in (429, 503):
+        return True
+    mensagem = str(erro)
+    return '429' in mensagem or 'Too Many Requests' in mensagem
+
+
+class BackendTTS:
+    """
+    Interface dos backends de síntese de voz.
+
+    Subclasses implementam _gerar(texto, lang, slow, filename); o método
+    público grava em um arquivo temporário e só depois renomeia para o
+    destino, então um arquivo nunca fica pela metade (nem sobrescreve no
+    lugar um hard link do cache).
+    """
+
+    nome = 'base'
+    descricao = 'Backend de TTS'
+
+    @classmethod
+    def disponivel(cls):
+        """Indica se o backend pode ser usado neste ambiente."""
+        return True
+
+    def sintetizar(self, texto, lang, slow, filename):
+        """
+        Sintetiza um texto e salva o áudio MP3 em filename.
+
+        Args:
+            texto: Texto a ser falado
+            lang: Idioma do áudio
+            slow: Se a fala deve ser lenta
+            filename: Caminho do arquivo de saída
+        """
+        temp_path = f"{filename}.part"
+        try:
+            self._gerar(texto, lang, slow, temp_path)
+            os.replace(temp_path, filename)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def sintetizar_bytes(self, texto, lang, slow):
+        """
+        Sintetiza um texto e retorna o áudio MP3 em memória, sem arquivo de saída.
+
+        Args:
+            texto: Texto a ser falado
+            lang: Idioma do áudio
+            slow: Se a fala deve ser lenta
+
+        Returns:
+            Bytes do MP3
+        """
+        return self._gerar_bytes(texto, lang, slow)
+
+    def sintetizar_varios(self, tarefas, lang, slow, max_workers=TTS_MAX_WORKERS, limitador=None,
+                          progresso=None, cancelar=None, ao_finalizar=None):
+        """
+        Sintetiza vários textos em paralelo.
+
+        Args:
+            tarefas: Lista de tuplas (texto, filename)
+            lang: Idioma dos áudios
+            slow: Se a fala deve ser lenta
+            max_workers: Número máximo de sínteses simultâneas
+            limitador: LimitadorAdaptativo compartilhado (opcional)
+            progresso: Função progresso(concluidas) chamada a cada áudio finalizado (opcional)
+            cancelar: threading.Event para interromper as sínteses pendentes (opcional)
+            ao_finalizar: Função ao_finalizar(indice, erro, duracao) chamada a cada áudio
+                          finalizado (opcional)
+
+        Returns:
+            Lista de tuplas (indice_da_tarefa, exceção) das tarefas que falharam
+        """
+        return sintetizar_concorrente(
+            tarefas,
+            lambda texto, filename: self.sintetizar(texto, lang, slow, filename),
+            max_workers=max_workers,
+            limitador=limitador,
+            progresso=progresso,
+            cancelar=cancelar,
+            ao_finalizar=ao_finalizar
+        )
+
+    def _gerar(self, texto, lang, slow, filename):
+        raise NotImplementedError
+
+    def _gerar_bytes(self, texto, lang, slow):
+        # Backends que só sabem gravar em arquivo passam por um temporário
+        fd, temp_path = tempfile.mkstemp(suffix='.mp3')
+        os.close(fd)
+        try:
+            self._gerar(texto, lang, slow, temp_path)
+            with open(temp_path, 'rb') as f:
+                return f.read()
+        finally:
+            os.remove(temp_path)
+
+
+class BackendGTTS(BackendTTS):
+    """Google Text-to-Speech (requer internet)."""
+
+    nome = 'gtts'
+    descricao = 'Google Text-to-Speech'
+
+    def _gerar(self, texto, lang, slow, filename):
+        tts = gTTS(text=texto, lang=lang, slow=slow)
+        tts.save(filename)
+
+    def _gerar_bytes(self, texto, lang, slow):
+        buffer = io.BytesIO()
+        gTTS(text=texto, lang=lang, slow=slow).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+class BackendLocal(BackendTTS):
+    """
+    Síntese offline com espeak-ng (ou espeak), convertida para MP3 com
+    ffmpeg ou lame. Sem esses programas, usa o pyttsx3 quando instalado, uma
+    síntese por vez; sem codificador, esses áudios ficam em WAV/AIFF (o
+    player do Anki identifica o formato pelo conteúdo, não pela extensão).
+    """
+
+    nome = 'local'
+    descricao = 'Offline (espeak-ng / pyttsx3)'
+
+    # Palavras por minuto para fala normal e lenta
+    VELOCIDADE_NORMAL = 170
+    VELOCIDADE_LENTA = 120
+
+    _lock_pyttsx3 = threading.Lock()
+
+    @classmethod
+    def disponivel(cls):
+        if cls._espeak() and cls._codificador():
+            return True
+        try:
+            import pyttsx3  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    @staticmethod
+    def _espeak():
+        return shutil.which('espeak-ng') or shutil.which('espeak')
+
+    @staticmethod
+    def _codificador():
+        return shutil.which('ffmpeg') or shutil.which('lame')
+
+    def _gerar(self, texto, lang, slow, filename):
+        velocidade = self.VELOCIDADE_LENTA if slow else self.VELOCIDADE_NORMAL
+
+        if self._espeak() and self._codificador():
+            self._codificar(texto, lang, velocidade, filename)
+            return
+
+        import pyttsx3
+        # O pyttsx3 grava WAV (ou AIFF); com um codificador disponível, vira MP3
+        codificador = self._codificador()
+        destino = f"{filename}.wav" if codificador else filename
+        try:
+            # pyttsx3.init() devolve o mesmo motor para todas as threads, e runAndWait
+            # falha se outra thread já estiver no loop: uma síntese por vez
+            with self._lock_pyttsx3:
+                engine = pyttsx3.init()
+                engine.setProperty('rate', velocidade)
+                engine.save_to_file(texto, destino)
+                engine.runAndWait()
+            if codificador:
+                with open(destino, 'rb') as f:
+                    self._para_mp3(f.read(), filename)
+        finally:
+            if codificador and os.path.exists(destino):
+                os.remove(destino)
+
+    def _gerar_bytes(self, texto, lang, slow):
+        if self._espeak() and self._codificador():
+            # O codificador escreve o MP3 na saída padrão
+            velocidade = self.VELOCIDADE_LENTA if slow else self.VELOCIDADE_NORMAL
+            return self._codificar(texto, lang, velocidade, '-')
+        return super()._gerar_bytes(texto, lang, slow)
+
+    def _codificar(self, texto, lang, velocidade, filename):
+        """Sintetiza com espeak e codifica em MP3 (filename '-' = saída padrão, retornada)."""
+        wav = subprocess.run(
+            [self._espeak(), '-v', lang, '-s', str(velocidade), '--stdout', texto],
+            check=True, capture_output=True
+        ).stdout
+        return self._para_mp3(wav, filename)
+
+    def _para_mp3(self, audio, filename):
+        """Codifica áudio WAV/AIFF em MP3 com ffmpeg ou lame (filename '-' = saída padrão, retornada)."""
+        codificador = self._codificador()
+        if os.path.basename(codificador).startswith('ffmpeg'):
+            comando = [codificador, '-loglevel', 'error', '-y', '-i', '-',
+                       '-codec:a', 'libmp3lame', '-f', 'mp3', filename]
+        else:
+            comando = [codificador, '--quiet', '-', filename]
+        return subprocess.run(comando, input=audio, check=True, capture_output=True).stdout
+
+
+class BackendFake(BackendTTS):
+    """
+    Backend determinístico para testes e benchmarks: gera MP3 silencioso
+    (frames MPEG-1 Layer III válidos), com duração proporcional ao texto.
+    """
+
+    nome = 'fake'
+    descricao = 'Silent MP3 (offline, for tests)'
+
+    # Cabeçalho MPEG-1 Layer III, 128 kbps, 44.1 kHz, mono, sem CRC
+    CABECALHO_FRAME = bytes([0xFF, 0xFB, 0x90, 0xC0])
+    # 144 * 128000 / 44100 bytes por frame (sem padding); 1152 amostras = ~26 ms
+    TAMANHO_FRAME = 417
+
+    def __init__(self, latencia=0.0):
+        """
+        Args:
+            latencia: Espera (segundos) por áudio, para simular um backend remoto
+        """
+        self.latencia = latencia
+
+    def gerar_bytes(self, texto, slow=False):
+        """
+        Returns:
+            Bytes de um MP3 silencioso para o texto
+        """
+        frames = 10 + len(str(texto)) * (2 if slow else 1)
+        frame = self.CABECALHO_FRAME + bytes(self.TAMANHO_FRAME - len(self.CABECALHO_FRAME))
+        return frame * frames
+
+    def _gerar(self, texto, lang, slow, filename):
+        with open(filename, 'wb') as f:
+            f.write(self._gerar_bytes(texto, lang, slow))
+
+    def _gerar_bytes(self, texto, lang, slow):
+        if self.latencia:
+            time.sleep(self.latencia)
+        return self.gerar_bytes(texto, slow)
+
+
+BACKENDS = {
+    BackendGTTS.nome: BackendGTTS,
+    BackendLocal.nome: BackendLocal,
+    BackendFake.nome: BackendFake,
+}
+
+
+def obter_backend(backend=None):
+    """
+    Resolve o backend de TTS a usar.
+
+    Args:
+        backend: Instância de BackendTTS, nome registrado em BACKENDS ou None
+                 (usa a variável de ambiente ANKI_TTS_BACKEND, ou gTTS)
+
+    Returns:
+        Instância de BackendTTS
+    """
+    if isinstance(backend, BackendTTS):
+        return backend
+
+    nome = nome_backend(backend)
+    if nome not in BACKENDS:
+        raise ValueError(f"Backend de TTS desconhecido: {nome} (opções: {', '.join(BACKENDS)})")
+
+    classe = BACKENDS[nome]
+    if not classe.disponivel():
+        raise RuntimeError(f"Backend de TTS '{nome}' não está disponível neste ambiente")
+    return classe()
+
+
+def nome_backend(backend=None):
+    """
+    Nome do backend que obter_backend usaria, sem instanciá-lo.
+
+    Args:
+        backend: Instância de BackendTTS, nome registrado ou None
+    """
+    if isinstance(backend, BackendTTS):
+        return backend.nome
+    return backend or os.environ.get('ANKI_TTS_BACKEND') or TTS_BACKEND_PADRAO
+
+
+def nome_audio(texto, lang, slow, backend):
+    """
+    Nome do arquivo de áudio de um texto, derivado do hash do conteúdo.
+
+    Textos iguais (com o mesmo idioma, velocidade e backend) recebem sempre
+    o mesmo nome, então cada áudio é gravado uma única vez por pacote e os
+    merges reconhecem as mídias que o baralho já tem.
+
+    Args:
+        texto: Texto sintetizado
+        lang: Idioma do áudio
+        slow: Se a fala é lenta
+        backend: Nome do backend de TTS
+
+    Returns:
+        Nome do arquivo, no formato audio_<hash>.mp3
+    """
+    return f"audio_{CacheAudio.chave(texto, lang, slow, backend)[:16]}.mp3"
+
+
+def listar_backends_disponiveis():
+    """Retorna os nomes dos backends que podem ser usados neste ambiente."""
+    return [nome for nome, classe in BACKENDS.items() if classe.disponivel()]
+
+
+_cache_padrao = None
+_cache_padrao_lock = threading.Lock()
+
+
+def obter_cache_padrao():
+    """
+    Retorna o cache de áudios compartilhado pelo processo.
+
+    A pasta e o limite podem ser configurados pelas variáveis de ambiente
+    ANKI_TTS_CACHE_DIR e ANKI_TTS_CACHE_MB.
+    """
+    global _cache_padrao
+    with _cache_padrao_lock:
+        if _cache_padrao is None:
+            tamanho_mb = os.environ.get('ANKI_TTS_CACHE_MB')
+            _cache_padrao = CacheAudio(
+                os.environ.get('ANKI_TTS_CACHE_DIR'),
+                int(tamanho_mb) * 1024 * 1024 if tamanho_mb else CACHE_TAMANHO_MAXIMO
+            )
+        return _cache_padrao
+
+
+def _vincular_arquivo(origem, destino):
+    """
+    Disponibiliza o arquivo de origem no destino, por hard link quando possível.
+    """
+    if os.path.exists(destino):
+        os.remove(destino)
+    try:
+        os.link(origem, destino)
+    except OSError:
+        shutil.copyfile(origem, destino)
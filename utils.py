@@ -1,28 +1,62 @@
 import os
+import re
+import hashlib
+import logging
 import pandas as pd
-from gtts import gTTS
 import genanki
 from pathlib import Path
-import sqlite3
-import zipfile
 import tempfile
 import shutil
+from collections import deque
+from concurrent.futures import CancelledError
+from ingest import ler_planilha_em_lotes
+from apkg import APKG_MAX_MEMORIA, EscritorApkg, IndiceBaralho, LeitorApkg, anexar_apkg, escrever_apkg, \
+    escrever_apkg_em_memoria, hash_arquivo, normalizar_chave
+from metrics import contar, span
+from workspace import TravaArquivo
+from tts import CacheAudio, ManifestoSintese, TTS_MAX_WORKERS, nome_audio, nome_backend, obter_backend, \
+    obter_cache_padrao, sintetizar_concorrente
 
 
-def criar_audios(df, audio_folder_name, speed=1.0):
+# Colunas de preparar_notas que viram os campos da nota, na ordem do modelo
+CAMPOS_NOTA = ['Word', 'Translation', 'Phonetic', 'Context', 'Audio_Word_Tag', 'Audio_Context_Tag']
+
+logger = logging.getLogger(__name__)
+
+
+def criar_audios(df, audio_folder_name, speed=1.0, cache=None, max_workers=TTS_MAX_WORKERS, backend=None,
+                 cartas_existentes=None, progresso=None, cancelar=None, limitador=None, pasta=None):
     """
-    Cria arquivos de áudio MP3 para Word e Context do DataFrame usando gTTS (Google Text-to-Speech).
+    Cria arquivos de áudio MP3 para Word e Context do DataFrame usando um backend de TTS
+    (por padrão gTTS, Google Text-to-Speech).
+    
+    Áudios já sintetizados antes (mesmo texto, idioma, velocidade e backend) são
+    servidos pelo cache em disco, e só os textos novos são sintetizados, em paralelo.
+    O progresso fica no manifesto da pasta (manifesto.jsonl), então uma execução
+    interrompida retoma de onde parou e arquivos corrompidos são refeitos.
     
     Args:
         df: DataFrame com colunas 'Word', 'Phonetic' (opcional), 'Context'
         audio_folder_name: Nome da pasta onde os áudios serão salvos
         speed: Velocidade da fala (0.5 = lento, 1.0 = normal, 2.0 = rápido)
+        cache: CacheAudio a usar (None = cache padrão, False = sem cache)
+        max_workers: Número máximo de sínteses simultâneas
+        backend: Backend de TTS (instância ou nome: 'gtts', 'local', 'fake')
+        cartas_existentes: Set de chaves word|context já presentes no baralho de destino;
+                           essas linhas não ganham áudio, pois serão ignoradas no merge
+        progresso: Função progresso(concluidos, total) chamada conforme os áudios ficam prontos
+        cancelar: threading.Event; quando setado, a síntese para e InterruptedError é lançada
+                  (os áudios já prontos ficam no cache e são reaproveitados na próxima execução)
+        limitador: LimitadorAdaptativo compartilhado entre chamadas (opcional), para
+                   dividir um mesmo orçamento de sínteses simultâneas entre vários baralhos
+        pasta: Pasta onde a pasta de áudios é criada (padrão: pasta temporária do sistema);
+               o app usa a área de trabalho da sessão, para não misturar usuários
     
     Returns:
         Caminho da pasta onde os áudios foram salvos
     """
     # Criar diretório de áudios usando tempfile para compatibilidade com Streamlit Cloud
-    audio_dir = os.path.join(tempfile.gettempdir(), audio_folder_name)
+    audio_dir = os.path.join(pasta or tempfile.gettempdir(), audio_folder_name)
     os.makedirs(audio_dir, exist_ok=True)
     
     # Verificar se existe coluna Word
@@ -33,119 +67,514 @@ def criar_audios(df, audio_folder_name, speed=1.0):
     if 'Context' not in df.columns:
         raise ValueError("DataFrame deve ter coluna 'Context'")
     
-    # Gerar áudios para Word
-    palavras = df['Word'].tolist()
-    for i, palavra in enumerate(palavras):
-        if pd.notna(palavra):
-            try:
-                filename = os.path.join(audio_dir, f"word_{i+1}.mp3")
-                tts = gTTS(text=str(palavra), lang='en', slow=(speed < 0.8))
-                tts.save(filename)
-            except Exception as e:
-                print(f"Erro ao criar áudio Word {i+1}: {str(e)}")
-                continue
-    
-    # Gerar áudios para Context
-    contextos = df['Context'].tolist()
-    for i, contexto in enumerate(contextos):
-        if pd.notna(contexto):
-            try:
-                filename = os.path.join(audio_dir, f"context_{i+1}.mp3")
-                tts = gTTS(text=str(contexto), lang='en', slow=(speed < 0.8))
-                tts.save(filename)
-            except Exception as e:
-                print(f"Erro ao criar áudio Context {i+1}: {str(e)}")
-                continue
+    backend = obter_backend(backend)
+    if cache is None:
+        cache = obter_cache_padrao()
+    
+    slow = speed < 0.8
+    
+    with span('sintese', backend=backend.nome, linhas=len(df)) as atributos:
+        # Linhas que já estão no baralho de destino não precisam de áudio
+        linhas_existentes = set()
+        if cartas_existentes:
+            for i, (word, context) in enumerate(zip(df['Word'].tolist(), df['Context'].tolist())):
+                if chave_carta(word, context) in cartas_existentes:
+                    linhas_existentes.add(i)
+            contar('linhas_ja_no_baralho', len(linhas_existentes))
+            logger.info("⏭️  %d linhas já existem no baralho e não terão áudio gerado", len(linhas_existentes))
+        
+        # Os arquivos são nomeados pelo hash do texto: textos repetidos viram um único áudio
+        audios = {}
+        for coluna in ('Word', 'Context'):
+            for i, texto in enumerate(df[coluna].tolist()):
+                if pd.notna(texto) and i not in linhas_existentes:
+                    texto = str(texto)
+                    filename = os.path.join(audio_dir, nome_audio(texto, 'en', slow, backend.nome))
+                    audios.setdefault(filename, (texto, CacheAudio.chave(texto, 'en', slow, backend.nome)))
+        
+        with ManifestoSintese(audio_dir) as manifesto:
+            # Servir da pasta (se já gerado e íntegro) ou do cache o que existe e separar o que precisa ser sintetizado
+            tarefas = []
+            chaves_pendentes = []
+            hits_pasta = hits_cache = invalidos = 0
+            for filename, (texto, chave) in audios.items():
+                if os.path.exists(filename):
+                    if manifesto.valido(filename):
+                        if manifesto.registro(filename) is None:
+                            manifesto.registrar(filename, chave)
+                        hits_pasta += 1
+                        continue
+                    # Truncado ou corrompido (ex.: processo interrompido): sintetizar de novo
+                    invalidos += 1
+                    logger.warning("⚠️ Áudio inválido, será recriado: %s", os.path.basename(filename))
+                    os.remove(filename)
+                if cache and cache.obter(chave, filename):
+                    manifesto.registrar(filename, chave)
+                    hits_cache += 1
+                    continue
+                tarefas.append((texto, filename))
+                chaves_pendentes.append(chave)
+            hits = hits_pasta + hits_cache
+            
+            if progresso:
+                progresso(hits, len(audios))
+                progresso_sintese = lambda concluidas: progresso(hits + concluidas, len(audios))
+            else:
+                progresso_sintese = None
+            
+            # Cada áudio é registrado (e guardado no cache) assim que fica pronto,
+            # então uma execução interrompida retoma de onde parou
+            def ao_finalizar(indice, erro, duracao):
+                texto, filename = tarefas[indice]
+                if erro is None:
+                    manifesto.registrar(filename, chaves_pendentes[indice], duracao=duracao)
+                    contar('bytes_audio', manifesto.registro(filename)['bytes'], backend=backend.nome)
+                    if cache:
+                        cache.guardar(chaves_pendentes[indice], filename)
+                elif not isinstance(erro, CancelledError):
+                    manifesto.registrar(filename, chaves_pendentes[indice], status='erro', erro=erro)
+                    logger.warning("Erro ao criar áudio '%s': %s", texto, erro)
+            
+            erros = backend.sintetizar_varios(tarefas, 'en', slow, max_workers=max_workers,
+                                              limitador=limitador, progresso=progresso_sintese,
+                                              cancelar=cancelar, ao_finalizar=ao_finalizar)
+        
+        sintetizados = len(tarefas) - len(erros)
+        contar('audios_reaproveitados', hits_pasta, origem='pasta')
+        contar('audios_reaproveitados', hits_cache, origem='cache')
+        contar('audios_invalidos', invalidos)
+        contar('audios_sintetizados', sintetizados, backend=backend.nome)
+        contar('audios_com_erro', len(erros), backend=backend.nome)
+        atributos.update(audios=len(audios), reaproveitados=hits, sintetizados=sintetizados, erros=len(erros))
+        logger.info("♻️ Áudios: %d reaproveitados, %d sintetizados, %d com erro", hits, sintetizados, len(erros))
+    
+    if cancelar is not None and cancelar.is_set():
+        raise InterruptedError("Geração de áudios cancelada")
     
     return audio_dir
 
 
-def gerar_links_audios(df, audio_dir, excel_path, deck_name=None):
+def chave_carta(word, context):
+    """
+    Gera a chave usada para detectar cartas duplicadas.
+    
+    Args:
+        word: Valor da coluna Word (pode ser NaN)
+        context: Valor da coluna Context (pode ser NaN)
+    
+    Returns:
+        String no formato word|context em lowercase
+    """
+    word = str(word) if pd.notna(word) else ""
+    context = str(context) if pd.notna(context) else ""
+    return normalizar_chave(word, context)
+
+
+def diferenca_planilhas(anterior, novo):
+    """
+    Compara duas versões de uma planilha linha a linha, pelo hash do conteúdo.
+    
+    Uma linha da versão nova com o mesmo conteúdo de uma linha da anterior
+    (mesmo que tenha mudado de posição) está inalterada. As demais são
+    pareadas com uma linha da versão anterior que deixou de existir: primeiro
+    pela mesma chave word|context (só a tradução ou a fonética mudou), depois
+    pela mesma palavra e, por último, pelo mesmo contexto. O que sobra é linha
+    nova: uma linha trocada por outra sem nada em comum não herda a nota antiga.
+    
+    Args:
+        anterior: DataFrame da versão já processada
+        novo: DataFrame da versão nova
+    
+    Returns:
+        Tuple (inalteradas, editadas, novas): dicts {posição em novo: posição em
+        anterior} das linhas inalteradas e das editadas, e lista com as posições
+        (em novo) das linhas novas
+    """
+    colunas = ['Word', 'Translation', 'Phonetic', 'Context']
+    hashes_anteriores = pd.util.hash_pandas_object(anterior.reindex(columns=colunas), index=False).to_numpy()
+    hashes_novos = pd.util.hash_pandas_object(novo.reindex(columns=colunas), index=False).to_numpy()
+    
+    livres = {}
+    for posicao, h in enumerate(hashes_anteriores):
+        livres.setdefault(h, deque()).append(posicao)
+    
+    inalteradas = {}
+    restantes = []
+    for posicao, h in enumerate(hashes_novos):
+        if livres.get(h):
+            inalteradas[posicao] = livres[h].popleft()
+        else:
+            restantes.append(posicao)
+    
+    # Só as linhas que mudaram são pareadas: chave word|context, depois só a
+    # palavra (contexto editado), depois só o contexto (palavra corrigida).
+    # Linhas sem palavra nem contexto em comum nunca são pareadas
+    sobras = set(range(len(anterior))) - set(inalteradas.values())
+    textos = {
+        versao: (df['Word'].tolist(), df['Context'].tolist()) for versao, df in (('anterior', anterior), ('novo', novo))
+    }
+    criterios = (
+        lambda versao, posicao: chave_carta(textos[versao][0][posicao], textos[versao][1][posicao]),
+        lambda versao, posicao: _texto_comparavel(textos[versao][0][posicao]),
+        lambda versao, posicao: _texto_comparavel(textos[versao][1][posicao]),
+    )
+    editadas = {}
+    for criterio in criterios:
+        # Cada linha anterior só é candidata uma vez por critério, então basta consumir a fila
+        candidatas = {}
+        for posicao in sorted(sobras):
+            candidatas.setdefault(criterio('anterior', posicao), deque()).append(posicao)
+        sem_par = []
+        for posicao in restantes:
+            valor = criterio('novo', posicao)
+            if valor and candidatas.get(valor):
+                anterior_posicao = candidatas[valor].popleft()
+                editadas[posicao] = anterior_posicao
+                sobras.discard(anterior_posicao)
+            else:
+                sem_par.append(posicao)
+        restantes = sem_par
+    
+    return inalteradas, editadas, restantes
+
+
+def _texto_comparavel(valor):
+    return str(valor).strip().lower() if pd.notna(valor) else ''
+
+
+def caminho_baralho(deck_name, pasta=None):
+    """
+    Retorna o caminho do arquivo .apkg de um baralho.
+    
+    Caracteres inválidos em nomes de arquivo (inclusive separadores de pasta)
+    são trocados por '_', então o nome do baralho nunca aponta para fora da pasta.
+    
+    Args:
+        deck_name: Nome do baralho
+        pasta: Pasta dos baralhos (padrão: ANKI_DECKS_DIR ou o diretório de trabalho)
+    
+    Returns:
+        Caminho do arquivo {deck_name}.apkg na pasta
+    """
+    nome_arquivo = re.sub(r'[\\/:*?"<>|\x00-\x1f]', '_', str(deck_name)).strip(' .') or 'deck'
+    return os.path.join(pasta or os.environ.get('ANKI_DECKS_DIR') or os.getcwd(), f"{nome_arquivo}.apkg")
+
+
+def carregar_cartas_baralho(deck_name, chaves=None, pasta=None):
+    """
+    Carrega as chaves das cartas de um baralho já gerado, se existir.
+    
+    Usado antes de criar_audios para não sintetizar áudio de linhas que
+    criar_baralho_anki vai descartar como duplicadas.
+    
+    Args:
+        deck_name: Nome do baralho
+        chaves: Chaves a procurar (opcional); se informadas, só elas são consultadas no índice
+        pasta: Pasta dos baralhos (padrão: diretório de trabalho)
+    
+    Returns:
+        Set com chaves das cartas (vazio se o baralho ainda não existe)
+    """
+    apkg_path = caminho_baralho(deck_name, pasta)
+    if not os.path.exists(apkg_path):
+        return set()
+    if chaves is None:
+        return extrair_cartas_existentes(apkg_path)
+    try:
+        # A trava evita ler o baralho enquanto outra sessão o grava
+        with span('carregar_existentes', chaves=len(chaves)), TravaArquivo(apkg_path), \
+                IndiceBaralho(apkg_path) as indice:
+            return indice.existentes(chaves)
+    except Exception as e:
+        logger.warning("⚠️ Erro ao ler baralho existente: %s", e)
+        return set()
+
+
+def gerar_links_audios(df, audio_dir, excel_path, deck_name=None, speed=1.0, backend=None, retornar_resumo=False,
+                       cartas_existentes=None):
     """
     Adiciona colunas 'Audio_Word' e 'Audio_Context' ao DataFrame.
     
+    Os nomes dos arquivos são derivados do texto de cada célula (ver
+    tts.nome_audio), com os mesmos speed e backend usados em criar_audios.
+    A pasta de áudios é listada uma única vez, e a presença de cada arquivo é
+    verificada contra essa listagem.
+    
     Args:
         df: DataFrame com as palavras e contextos
         audio_dir: Diretório onde estão os arquivos de áudio
         excel_path: Caminho do arquivo Excel original para atualizar
         deck_name: Nome do baralho (usado para criar arquivo atualizado)
+        speed: Velocidade da fala usada em criar_audios
+        backend: Backend de TTS usado em criar_audios
+        retornar_resumo: Se True, retorna também o resumo dos áudios encontrados/faltando
+        cartas_existentes: Set de chaves word|context que criar_audios pulou por já estarem
+                           no baralho; ficam sem link, mas não contam como faltando
     
     Returns:
-        DataFrame com colunas de áudio adicionadas
-    """
-    import os
-    
-    print(f"🔍 Debug - Audio dir: {audio_dir}")
-    print(f"🔍 Debug - Número de linhas: {len(df)}")
-    
-    # Criar listas de nomes de arquivos
-    audio_word = []
-    audio_context = []
-    word_encontrados = 0
-    context_encontrados = 0
-    
-    for i in range(len(df)):
-        # Áudio Word
-        audio_file_word = f"word_{i+1}.mp3"
-        audio_path_word = os.path.join(audio_dir, audio_file_word)
-        if os.path.exists(audio_path_word):
-            audio_word.append(audio_file_word)
-            word_encontrados += 1
-        else:
-            audio_word.append("")
-            print(f"⚠️ Áudio Word não encontrado: {audio_path_word}")
+        DataFrame com colunas de áudio adicionadas, ou tuple (DataFrame, resumo)
+        se retornar_resumo=True. O resumo é um dict com 'total',
+        'word_encontrados', 'context_encontrados' e 'faltando' (lista de dicts
+        com 'linha', 'coluna', 'texto' e 'arquivo')
+    """
+    slow = speed < 0.8
+    backend = nome_backend(backend)
+    
+    with span('links', linhas=len(df)):
+        disponiveis = listar_audios(audio_dir)
+        
+        df_copy = df.copy()
+        resumo = {'total': len(df), 'faltando': []}
         
-        # Áudio Context
-        audio_file_ctx = f"context_{i+1}.mp3"
-        audio_path_ctx = os.path.join(audio_dir, audio_file_ctx)
-        if os.path.exists(audio_path_ctx):
-            audio_context.append(audio_file_ctx)
-            context_encontrados += 1
+        if cartas_existentes:
+            puladas = pd.Series(
+                [chave_carta(word, context) in cartas_existentes
+                 for word, context in zip(df['Word'].tolist(), df['Context'].tolist())],
+                index=df.index
+            )
         else:
-            audio_context.append("")
-            print(f"⚠️ Áudio Context não encontrado: {audio_path_ctx}")
-    
-    print(f"✅ Áudios Word encontrados: {word_encontrados}/{len(df)}")
-    print(f"✅ Áudios Context encontrados: {context_encontrados}/{len(df)}")
-    
-    # Adicionar colunas ao DataFrame
-    df_copy = df.copy()
-    df_copy['Audio_Word'] = audio_word
-    df_copy['Audio_Context'] = audio_context
+            puladas = pd.Series(False, index=df.index)
+        
+        for coluna, destino in (('Word', 'Audio_Word'), ('Context', 'Audio_Context')):
+            textos = df[coluna].where(df[coluna].notna(), None)
+            
+            # Calcular o nome uma vez por texto distinto
+            nomes_por_texto = {
+                texto: nome_audio(str(texto), 'en', slow, backend)
+                for texto in textos.dropna().unique()
+            }
+            arquivos = textos.map(nomes_por_texto).fillna('').astype(str)
+            encontrados = arquivos.isin(disponiveis)
+            
+            df_copy[destino] = arquivos.where(encontrados, '')
+            resumo[f'{coluna.lower()}_encontrados'] = int(encontrados.sum())
+            
+            faltando = ~encontrados & textos.notna() & ~puladas
+            for linha, texto, arquivo in zip(df.index[faltando], textos[faltando], arquivos[faltando]):
+                resumo['faltando'].append({'linha': linha, 'coluna': coluna, 'texto': str(texto), 'arquivo': arquivo})
+    
+    contar('audios_faltando', len(resumo['faltando']))
+    logger.info("✅ Áudios encontrados: Word %d/%d, Context %d/%d",
+                resumo['word_encontrados'], len(df), resumo['context_encontrados'], len(df))
+    if resumo['faltando']:
+        logger.warning("⚠️ %d áudios não encontrados em %s", len(resumo['faltando']), audio_dir)
+    
+    if retornar_resumo:
+        return df_copy, resumo
+    return df_copy
+
+
+def listar_audios(audio_dir):
+    """
+    Lista os nomes dos arquivos de áudio de uma pasta com um único os.scandir.
     
-    print(f"✅ DataFrame com {len(df_copy)} linhas e colunas: {df_copy.columns.tolist()}")
+    Args:
+        audio_dir: Diretório dos áudios
     
-    return df_copy
+    Returns:
+        Set com os nomes dos arquivos (vazio se a pasta não existir)
+    """
+    if not audio_dir:
+        return set()
+    try:
+        with os.scandir(audio_dir) as it:
+            return {entry.name for entry in it if entry.is_file()}
+    except OSError:
+        return set()
 
 
-def criar_baralho_anki(df, audio_dir, deck_name, deck_id, model_id):
+def criar_baralho_anki(df, audio_dir, deck_name, deck_id, model_id, incremental=True, pasta=None, salvar=True,
+                       chaves_anteriores=None):
     """
     Cria um baralho Anki (.apkg) com as cartas e áudios.
     Se o baralho já existir, adiciona as novas cartas ao baralho existente.
     
+    No modo incremental, as notas novas são inseridas na coleção do baralho
+    existente e só as mídias novas são anexadas ao arquivo, sem regravar o
+    restante. Caso contrário, o pacote é regravado inteiro (as notas e mídias
+    antigas são preservadas, copiadas do arquivo anterior).
+    
     Args:
         df: DataFrame com colunas 'Word', 'Translation' (opcional), 'Phonetic' (opcional), 'Context', 'Audio_Word', 'Audio_Context'
         audio_dir: Diretório onde estão os arquivos de áudio
         deck_name: Nome do baralho
         deck_id: ID único do baralho
         model_id: ID único do modelo
+        incremental: Se True, anexa ao baralho existente em vez de regravá-lo
+        pasta: Pasta onde o .apkg é gravado (padrão: diretório de trabalho)
+        salvar: Se False, o pacote (já mesclado com o baralho existente, se houver) é
+                montado em memória (ver apkg.escrever_apkg_em_memoria) e nada é gravado
+                na pasta; o retorno traz o buffer em vez do caminho
+        chaves_anteriores: Dict {índice da linha: chave word|context anterior} das linhas
+                           editadas desde a versão já empacotada (ver diferenca_planilhas);
+                           a nota da chave anterior tem os campos regravados no lugar (mesmo
+                           guid, histórico de revisões preservado) em vez de virar uma carta nova
     
     Returns:
-        Tuple (caminho do arquivo .apkg criado, número de cartas adicionadas, total de cartas)
+        Tuple (caminho do arquivo .apkg criado — ou buffer com o pacote, se salvar=False —,
+        número de cartas adicionadas, total de cartas)
     """
-    output_filename = f"{deck_name}.apkg"
-    output_path = os.path.join(os.getcwd(), output_filename)
-    
-    # Verificar se o baralho já existe
-    cartas_existentes = []
+    output_path = caminho_baralho(deck_name, pasta)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    
+    # Outra sessão (ou worker do cli.py) pode estar gravando o mesmo baralho:
+    # a leitura das cartas existentes e a gravação acontecem sob a mesma trava
+    with TravaArquivo(output_path):
+        return _gravar_baralho(df, audio_dir, deck_name, deck_id, model_id, incremental, output_path, salvar,
+                               chaves_anteriores)
+
+
+def _gravar_baralho(df, audio_dir, deck_name, deck_id, model_id, incremental, output_path, salvar,
+                    chaves_anteriores=None):
+    output_filename = os.path.basename(output_path)
+    
+    # Preparar campos, chaves e tags de som de todas as linhas de uma vez
+    with span('preparar_notas', linhas=len(df)):
+        notas = preparar_notas(df, audio_dir)
+    chaves = notas['Chave'].tolist()
+    
+    # Verificar se o baralho já existe (consultando o índice do baralho, sem abrir o .apkg)
+    cartas_existentes = set()
+    total_existentes = 0
+    indice = None
     if os.path.exists(output_path):
-        print(f"📦 Baralho existente encontrado: {output_filename}")
-        print("🔄 Carregando cartas existentes...")
-        cartas_existentes = extrair_cartas_existentes(output_path)
-        print(f"✅ {len(cartas_existentes)} cartas já existem no baralho")
+        logger.info("📦 Baralho existente encontrado: %s", output_filename)
+        with span('carregar_existentes', chaves=len(chaves)):
+            try:
+                indice = IndiceBaralho(output_path)
+                cartas_existentes = indice.existentes(chaves)
+                total_existentes = indice.total_notas()
+            except Exception as e:
+                logger.warning("⚠️ Erro ao ler baralho existente: %s", e)
+                if indice is not None:
+                    indice.fechar()
+                    indice = None
+        logger.info("✅ %d cartas já existem no baralho", total_existentes)
+    
+    # Linhas editadas: a nota da chave anterior é regravada, a menos que a chave nova
+    # já seja de outra carta do baralho (a linha virou duplicata)
+    atualizacoes = []
+    renomeadas = []
+    if chaves_anteriores and indice is not None:
+        guids_anteriores = indice.guids(set(chaves_anteriores.values()))
+        chaves_linhas = dict(zip(notas.index, chaves))
+        for linha, chave_antiga in chaves_anteriores.items():
+            chave_nova = chaves_linhas.get(linha)
+            guid = guids_anteriores.get(chave_antiga)
+            if guid is None or chave_nova is None:
+                continue
+            if chave_nova != chave_antiga:
+                if chave_nova in cartas_existentes:
+                    continue
+                renomeadas.append((chave_antiga, chave_nova))
+            atualizacoes.append((linha, guid))
+        # As linhas atualizadas não entram como cartas novas
+        cartas_existentes = cartas_existentes | {chaves_linhas[linha] for linha, _ in atualizacoes}
+    
+    my_model = criar_modelo(model_id)
+    
+    # Criar baralho
+    my_deck = genanki.Deck(deck_id, deck_name)
+    
+    with span('montar_notas', linhas=len(notas)):
+        novas, notas_novas, cartas_duplicadas = adicionar_notas(my_deck, my_model, notas, cartas_existentes)
+        cartas_novas = len(notas_novas)
+        cartas_duplicadas -= len(atualizacoes)
+        
+        atualizadas = notas.loc[[linha for linha, _ in atualizacoes]]
+        campos_atualizados = [
+            (guid, list(campos))
+            for (_, guid), campos in zip(atualizacoes, atualizadas[CAMPOS_NOTA].itertuples(index=False, name=None))
+        ]
+        
+        # Lista para arquivos de mídia (só os que existem na pasta de áudios)
+        audio_files = [
+            os.path.join(audio_dir, nome)
+            for linhas in (novas, atualizadas)
+            for nome in pd.concat([linhas['Audio_Word_File'], linhas['Audio_Context_File']])
+            if nome
+        ]
+        
+        # Cada áudio entra uma vez só no pacote (os nomes vêm do hash do texto), e
+        # os que o baralho existente já tem não precisam ser gravados de novo
+        audio_files = list(dict.fromkeys(audio_files))
+        if indice is not None and audio_files:
+            midias_presentes = indice.midias_existentes(os.path.basename(path) for path in audio_files)
+            audio_files = [path for path in audio_files if os.path.basename(path) not in midias_presentes]
+    
+    # Criar pacote com arquivos de mídia
+    my_package = genanki.Package(my_deck)
+    my_package.media_files = audio_files
+    
+    # Salvar arquivo .apkg
+    with span('gravar_pacote', cartas_novas=cartas_novas, midias=len(audio_files)) as atributos:
+        if not salvar:
+            # Só leitura do baralho existente: o pacote vai para a memória e o índice não muda
+            atributos['modo'] = 'memoria'
+            if indice is None:
+                buffer = escrever_apkg_em_memoria(my_package)
+            else:
+                indice.fechar()
+                with LeitorApkg(output_path) as leitor:
+                    buffer = escrever_apkg_em_memoria(my_package, leitor, atualizacoes=campos_atualizados)
+            buffer.seek(0, os.SEEK_END)
+            tamanho_pacote = buffer.tell()
+            buffer.seek(0)
+        elif indice is None:
+            atributos['modo'] = 'novo'
+            my_package.write_to_file(output_path)
+            indice = IndiceBaralho(output_path, validar=False)
+            indice.limpar()
+        elif cartas_novas == 0 and not atualizacoes:
+            atributos['modo'] = 'inalterado'
+            logger.info("ℹ️ Nenhuma carta nova: baralho existente mantido sem alterações")
+        elif incremental:
+            atributos['modo'] = 'anexar'
+            logger.info("🔗 Anexando ao baralho existente...")
+            anexar_apkg(output_path, my_package, atualizacoes=campos_atualizados)
+        else:
+            # As mídias antigas vão direto do zip antigo para o novo
+            atributos['modo'] = 'regravar'
+            logger.info("🔗 Mesclando com baralho existente...")
+            with LeitorApkg(output_path) as leitor:
+                escrever_apkg(my_package, output_path, leitor, atualizacoes=campos_atualizados)
+        
+        if salvar:
+            # Atualizar o índice do baralho com o que foi gravado
+            try:
+                if cartas_novas > 0 or atualizacoes:
+                    indice.registrar_notas(notas_novas)
+                    indice.renomear_notas(renomeadas)
+                    indice.registrar_midias([(os.path.basename(path), hash_arquivo(path)) for path in audio_files])
+                indice.carimbar()
+            finally:
+                indice.fechar()
+            tamanho_pacote = os.path.getsize(output_path)
+    
+    total_cartas = total_existentes + cartas_novas
+    
+    contar('cartas_novas', cartas_novas)
+    contar('cartas_duplicadas', cartas_duplicadas)
+    contar('cartas_atualizadas', len(atualizacoes))
+    contar('midias_gravadas', len(audio_files))
+    contar('bytes_pacote', tamanho_pacote)
+    logger.info("📊 Resumo: %d cartas novas, %d atualizadas, %d duplicadas ignoradas, %d no baralho",
+                cartas_novas, len(atualizacoes), cartas_duplicadas, total_cartas)
+    
+    return (output_path if salvar else buffer), cartas_novas, total_cartas
+
+
+def criar_modelo(model_id):
+    """
+    Cria o modelo de nota (campos, template do cartão e CSS) dos baralhos.
     
-    # Criar modelo do cartão
-    my_model = genanki.Model(
+    Args:
+        model_id: ID único do modelo
+    
+    Returns:
+        genanki.Model
+    """
+    return genanki.Model(
         model_id,
         'Anki Model with Translation and Phonetic',
         fields=[
@@ -199,85 +628,305 @@ def criar_baralho_anki(df, audio_dir, deck_name, deck_id, model_id):
             }
         '''
     )
+
+
+def adicionar_notas(deck, model, notas, cartas_existentes):
+    """
+    Adiciona ao baralho as notas que ainda não existem nele.
     
-    # Criar baralho
-    my_deck = genanki.Deck(deck_id, deck_name)
+    Args:
+        deck: genanki.Deck de destino
+        model: genanki.Model das notas
+        notas: DataFrame retornado por preparar_notas
+        cartas_existentes: Set de chaves word|context já presentes no baralho
     
-    # Lista para arquivos de mídia
-    audio_files = []
-    cartas_novas = 0
-    cartas_duplicadas = 0
-    
-    # Adicionar cartas ao baralho
-    for index, row in df.iterrows():
-        word = str(row['Word']) if pd.notna(row['Word']) else ""
-        translation = str(row['Translation']) if 'Translation' in row and pd.notna(row['Translation']) else ""
-        phonetic = str(row['Phonetic']) if 'Phonetic' in row and pd.notna(row['Phonetic']) else ""
-        context = str(row['Context']) if pd.notna(row['Context']) else ""
-        
-        # Verificar se a carta já existe (comparar Word + Context)
-        carta_key = f"{word.strip().lower()}|{context.strip().lower()}"
-        if carta_key in cartas_existentes:
-            cartas_duplicadas += 1
-            print(f"⏭️  Carta duplicada ignorada: {word}")
-            continue
-        
-        audio_word_file = str(row['Audio_Word']) if pd.notna(row['Audio_Word']) else ""
-        audio_context_file = str(row['Audio_Context']) if pd.notna(row['Audio_Context']) else ""
-        
-        # Processar áudio Word
-        if audio_word_file:
-            audio_path = os.path.join(audio_dir, audio_word_file)
-            if os.path.exists(audio_path):
-                audio_files.append(audio_path)
-                audio_word_tag = f'[sound:{audio_word_file}]'
-            else:
-                audio_word_tag = ""
+    Returns:
+        Tuple (linhas de notas adicionadas, lista de tuplas (chave, guid) das notas
+        novas, número de duplicadas ignoradas)
+    """
+    # Separar as linhas que já existem no baralho
+    duplicadas = notas['Chave'].isin(cartas_existentes).to_numpy()
+    novas = notas[~duplicadas]
+    
+    notas_novas = []
+    for fields, carta_key in zip(novas[CAMPOS_NOTA].itertuples(index=False, name=None), novas['Chave']):
+        my_note = genanki.Note(model=model, fields=list(fields))
+        deck.add_note(my_note)
+        notas_novas.append((carta_key, my_note.guid))
+    return novas, notas_novas, int(duplicadas.sum())
+
+
+def gerar_baralho_em_fluxo(df, deck_name, deck_id, model_id, speed=1.0, cache=None, max_workers=TTS_MAX_WORKERS,
+                           backend=None, progresso=None, cancelar=None, limitador=None, pasta=None, salvar=True):
+    """
+    Gera o baralho em um único passo, montando o pacote enquanto os áudios são sintetizados.
+
+    Faz o mesmo que criar_audios + gerar_links_audios + criar_baralho_anki, mas
+    sem pasta de áudios: cada áudio é sintetizado para a memória
+    (BackendTTS.sintetizar_bytes) e gravado no zip do pacote assim que fica
+    pronto (ver apkg.EscritorApkg). Quando o último áudio termina, só faltam a
+    coleção e o mapa 'media'. Os áudios do cache entram direto no pacote, e os
+    sintetizados são guardados no cache, então uma execução interrompida retoma
+    de onde parou.
+
+    O baralho existente só é travado no fim, para a mesclagem: as cartas que
+    outra sessão acrescentou durante a síntese são descartadas como duplicadas,
+    e as notas e mídias antigas são copiadas para o pacote novo, como em
+    criar_baralho_anki com incremental=False.
+
+    Args:
+        df: DataFrame com colunas 'Word', 'Translation' (opcional), 'Phonetic' (opcional), 'Context'
+        deck_name: Nome do baralho
+        deck_id: ID único do baralho
+        model_id: ID único do modelo
+        speed: Velocidade da fala (0.5 = lento, 1.0 = normal, 2.0 = rápido)
+        cache: CacheAudio a usar (None = cache padrão, False = sem cache)
+        max_workers: Número máximo de sínteses simultâneas
+        backend: Backend de TTS (instância ou nome: 'gtts', 'local', 'fake')
+        progresso: Função progresso(concluidos, total) chamada conforme os áudios ficam prontos
+        cancelar: threading.Event; quando setado, a síntese para e InterruptedError é lançada
+        limitador: LimitadorAdaptativo compartilhado entre chamadas (opcional)
+        pasta: Pasta onde o .apkg é gravado (padrão: diretório de trabalho)
+        salvar: Se False, o pacote é montado em memória e nada é gravado na pasta
+
+    Returns:
+        Tuple (caminho do arquivo .apkg — ou buffer com o pacote, se salvar=False —,
+        número de cartas adicionadas, total de cartas)
+    """
+    if 'Word' not in df.columns:
+        raise ValueError("DataFrame deve ter coluna 'Word'")
+    if 'Context' not in df.columns:
+        raise ValueError("DataFrame deve ter coluna 'Context'")
+
+    backend = obter_backend(backend)
+    if cache is None:
+        cache = obter_cache_padrao()
+
+    slow = speed < 0.8
+    output_path = caminho_baralho(deck_name, pasta)
+
+    # Os nomes dos áudios vêm do hash do texto, então as tags das notas já são conhecidas
+    df = df.copy()
+    for coluna, coluna_audio in (('Word', 'Audio_Word'), ('Context', 'Audio_Context')):
+        df[coluna_audio] = [
+            nome_audio(str(texto), 'en', slow, backend.nome) if pd.notna(texto) else ''
+            for texto in df[coluna].tolist()
+        ]
+    chaves = [chave_carta(word, context) for word, context in zip(df['Word'].tolist(), df['Context'].tolist())]
+
+    # Linhas e mídias que o baralho já tem não precisam de áudio
+    cartas_existentes = set()
+    midias_presentes = set()
+    if os.path.exists(output_path):
+        with span('carregar_existentes', chaves=len(chaves)):
+            try:
+                with TravaArquivo(output_path), IndiceBaralho(output_path) as indice:
+                    cartas_existentes = indice.existentes(chaves)
+                    midias_presentes = indice.midias_existentes(
+                        nome for coluna in ('Audio_Word', 'Audio_Context') for nome in df[coluna] if nome
+                    )
+            except Exception as e:
+                logger.warning("⚠️ Erro ao ler baralho existente: %s", e)
+
+    audios = {}
+    for coluna, coluna_audio in (('Word', 'Audio_Word'), ('Context', 'Audio_Context')):
+        for chave, texto, nome in zip(chaves, df[coluna].tolist(), df[coluna_audio].tolist()):
+            if nome and chave not in cartas_existentes and nome not in midias_presentes:
+                audios.setdefault(nome, (str(texto), CacheAudio.chave(str(texto), 'en', slow, backend.nome)))
+
+    # A trava do baralho fica na pasta dele, mesmo quando o pacote só é montado em memória
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    if salvar:
+        fd, destino = tempfile.mkstemp(dir=os.path.dirname(output_path), suffix='.apkg.tmp')
+        os.close(fd)
+    else:
+        destino = tempfile.SpooledTemporaryFile(max_size=APKG_MAX_MEMORIA, suffix='.apkg')
+
+    try:
+        with EscritorApkg(destino) as escritor:
+            hashes = {}
+
+            def gravar_midia(nome, dados):
+                escritor.adicionar_midia(nome, dados)
+                hashes[nome] = hashlib.sha256(dados).hexdigest()
+
+            with span('sintese', backend=backend.nome, linhas=len(df), modo='fluxo') as atributos:
+                tarefas = []
+                chaves_pendentes = []
+                for nome, (texto, chave) in audios.items():
+                    dados = cache.obter_bytes(chave) if cache else None
+                    if dados is not None:
+                        gravar_midia(nome, dados)
+                        continue
+                    tarefas.append((texto, nome))
+                    chaves_pendentes.append(chave)
+                hits = len(audios) - len(tarefas)
+
+                if progresso:
+                    progresso(hits, len(audios))
+                    progresso_sintese = lambda concluidas: progresso(hits + concluidas, len(audios))
+                else:
+                    progresso_sintese = None
+
+                # As threads só sintetizam; o zip é gravado na thread atual, em ao_finalizar
+                clipes = {}
+
+                def sintetizar(texto, nome):
+                    clipes[nome] = backend.sintetizar_bytes(texto, 'en', slow)
+
+                def ao_finalizar(indice, erro, duracao):
+                    texto, nome = tarefas[indice]
+                    if erro is None:
+                        dados = clipes.pop(nome)
+                        gravar_midia(nome, dados)
+                        contar('bytes_audio', len(dados), backend=backend.nome)
+                        if cache:
+                            cache.guardar_bytes(chaves_pendentes[indice], dados)
+                    elif not isinstance(erro, CancelledError):
+                        logger.warning("Erro ao criar áudio '%s': %s", texto, erro)
+
+                erros = sintetizar_concorrente(tarefas, sintetizar, max_workers=max_workers,
+                                               limitador=limitador, progresso=progresso_sintese,
+                                               cancelar=cancelar, ao_finalizar=ao_finalizar)
+
+                sintetizados = len(tarefas) - len(erros)
+                contar('audios_reaproveitados', hits, origem='cache')
+                contar('audios_sintetizados', sintetizados, backend=backend.nome)
+                contar('audios_com_erro', len(erros), backend=backend.nome)
+                atributos.update(audios=len(audios), reaproveitados=hits, sintetizados=sintetizados, erros=len(erros))
+                logger.info("♻️ Áudios: %d reaproveitados, %d sintetizados, %d com erro", hits, sintetizados, len(erros))
+
+            if cancelar is not None and cancelar.is_set():
+                raise InterruptedError("Geração de áudios cancelada")
+
+            with TravaArquivo(output_path):
+                resultado = _finalizar_fluxo(df, escritor, hashes, midias_presentes, deck_name, deck_id,
+                                             model_id, output_path, destino, salvar)
+    except BaseException:
+        if salvar:
+            if os.path.exists(destino):
+                os.remove(destino)
         else:
-            audio_word_tag = ""
-        
-        # Processar áudio Context
-        if audio_context_file:
-            audio_path = os.path.join(audio_dir, audio_context_file)
-            if os.path.exists(audio_path):
-                audio_files.append(audio_path)
-                audio_context_tag = f'[sound:{audio_context_file}]'
+            destino.close()
+        raise
+
+    return resultado
+
+
+def _finalizar_fluxo(df, escritor, hashes, midias_presentes, deck_name, deck_id, model_id, output_path,
+                     destino, salvar):
+    # O baralho pode ter mudado durante a síntese: as cartas existentes são lidas de novo, sob a trava
+    indice = None
+    cartas_existentes = set()
+    total_existentes = 0
+    if os.path.exists(output_path):
+        try:
+            indice = IndiceBaralho(output_path)
+            cartas_existentes = indice.existentes(
+                [chave_carta(word, context) for word, context in zip(df['Word'].tolist(), df['Context'].tolist())]
+            )
+            total_existentes = indice.total_notas()
+        except Exception as e:
+            logger.warning("⚠️ Erro ao ler baralho existente: %s", e)
+            if indice is not None:
+                indice.fechar()
+                indice = None
+
+    try:
+        with span('montar_notas', linhas=len(df)):
+            notas = preparar_notas(df, None, disponiveis=set(escritor.midias) | midias_presentes)
+            my_deck = genanki.Deck(deck_id, deck_name)
+            _, notas_novas, cartas_duplicadas = adicionar_notas(my_deck, criar_modelo(model_id), notas,
+                                                                cartas_existentes)
+            cartas_novas = len(notas_novas)
+
+        with span('gravar_pacote', cartas_novas=cartas_novas, midias=len(escritor.midias)) as atributos:
+            my_package = genanki.Package(my_deck)
+            existia = indice is not None
+            if existia:
+                indice.fechar()
+                indice = None
+                with LeitorApkg(output_path) as leitor:
+                    escritor.finalizar(my_package, leitor)
             else:
-                audio_context_tag = ""
-        else:
-            audio_context_tag = ""
-        
-        # Criar nota
-        my_note = genanki.Note(
-            model=my_model,
-            fields=[word, translation, phonetic, context, audio_word_tag, audio_context_tag]
-        )
-        
-        # Adicionar nota ao baralho
-        my_deck.add_note(my_note)
-        cartas_novas += 1
+                escritor.finalizar(my_package)
+
+            if not salvar:
+                atributos['modo'] = 'memoria'
+                destino.seek(0, os.SEEK_END)
+                tamanho_pacote = destino.tell()
+                destino.seek(0)
+            elif existia and cartas_novas == 0:
+                atributos['modo'] = 'inalterado'
+                logger.info("ℹ️ Nenhuma carta nova: baralho existente mantido sem alterações")
+                os.remove(destino)
+                tamanho_pacote = os.path.getsize(output_path)
+            else:
+                atributos['modo'] = 'fluxo'
+                os.replace(destino, output_path)
+                # Atualizar o índice do baralho com o que foi gravado
+                indice = IndiceBaralho(output_path, validar=False)
+                if not existia:
+                    indice.limpar()
+                indice.registrar_notas(notas_novas)
+                indice.registrar_midias(hashes.items())
+                indice.carimbar()
+                tamanho_pacote = os.path.getsize(output_path)
+    finally:
+        if indice is not None:
+            indice.fechar()
+
+    total_cartas = total_existentes + cartas_novas
+
+    contar('cartas_novas', cartas_novas)
+    contar('cartas_duplicadas', cartas_duplicadas)
+    contar('midias_gravadas', len(escritor.midias))
+    contar('bytes_pacote', tamanho_pacote)
+    logger.info("📊 Resumo: %d cartas novas, %d duplicadas ignoradas, %d no baralho",
+                cartas_novas, cartas_duplicadas, total_cartas)
+
+    return (output_path if salvar else destino), cartas_novas, total_cartas
+
+
+def preparar_notas(df, audio_dir, disponiveis=None):
+    """
+    Prepara, coluna a coluna, os campos das notas de todas as linhas do DataFrame.
     
-    # Se o baralho já existia, fazer merge dos arquivos de áudio antigos
-    if os.path.exists(output_path) and cartas_novas > 0:
-        print(f"🔗 Mesclando com baralho existente...")
-        audio_files_antigos = extrair_audios_existentes(output_path)
-        audio_files.extend(audio_files_antigos)
+    Normaliza os textos (NaN vira ""), calcula as chaves de duplicata e monta as
+    tags [sound:...] só para os áudios presentes em audio_dir, com uma única
+    listagem da pasta em vez de verificar arquivo por arquivo.
     
-    # Criar pacote com arquivos de mídia
-    my_package = genanki.Package(my_deck)
-    my_package.media_files = audio_files
+    Args:
+        df: DataFrame com colunas 'Word', 'Translation' (opcional), 'Phonetic' (opcional), 'Context', 'Audio_Word', 'Audio_Context'
+        audio_dir: Diretório onde estão os arquivos de áudio
+        disponiveis: Set com os nomes dos áudios disponíveis (padrão: listagem de audio_dir)
     
-    # Salvar arquivo .apkg
-    my_package.write_to_file(output_path)
+    Returns:
+        DataFrame com as colunas de texto normalizadas, 'Chave', 'Audio_Word_File',
+        'Audio_Context_File' (nome do áudio, ou "" se não existir) e
+        'Audio_Word_Tag'/'Audio_Context_Tag' (tag de som para o campo da nota)
+    """
+    notas = pd.DataFrame(index=df.index)
+    for coluna in ('Word', 'Translation', 'Phonetic', 'Context', 'Audio_Word', 'Audio_Context'):
+        if coluna in df.columns:
+            valores = df[coluna]
+            notas[coluna] = valores.where(valores.notna(), '').astype(str)
+        else:
+            notas[coluna] = ''
+    
+    notas['Chave'] = (
+        notas['Word'].str.strip().str.lower() + '|' + notas['Context'].str.strip().str.lower()
+    )
     
-    total_cartas = len(cartas_existentes) + cartas_novas
+    if disponiveis is None:
+        disponiveis = listar_audios(audio_dir)
     
-    print(f"\n📊 Resumo:")
-    print(f"  ✅ Cartas novas adicionadas: {cartas_novas}")
-    print(f"  ⏭️  Cartas duplicadas ignoradas: {cartas_duplicadas}")
-    print(f"  📦 Total de cartas no baralho: {total_cartas}")
+    for coluna in ('Audio_Word', 'Audio_Context'):
+        arquivos = notas[coluna].where(notas[coluna].isin(disponiveis), '')
+        notas[f'{coluna}_File'] = arquivos
+        notas[f'{coluna}_Tag'] = ('[sound:' + arquivos + ']').where(arquivos != '', '')
     
-    return output_path, cartas_novas, total_cartas
+    return notas
 
 
 def extrair_cartas_existentes(apkg_path):
@@ -290,133 +939,74 @@ def extrair_cartas_existentes(apkg_path):
     Returns:
         Set com chaves das cartas (word|context em lowercase)
     """
-    cartas = set()
-    temp_dir = tempfile.mkdtemp()
-    
     try:
-        # Extrair o .apkg (é um arquivo ZIP)
-        with zipfile.ZipFile(apkg_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
-        
-        # Ler o banco de dados SQLite
-        db_path = os.path.join(temp_dir, 'collection.anki2')
-        if not os.path.exists(db_path):
-            db_path = os.path.join(temp_dir, 'collection.anki21')
-        
-        if os.path.exists(db_path):
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            
-            # Buscar todas as notas (campo 'flds' contém os campos separados por \x1f)
-            cursor.execute("SELECT flds FROM notes")
-            rows = cursor.fetchall()
-            
-            for row in rows:
-                fields = row[0].split('\x1f')
-                if len(fields) >= 4:
-                    word = fields[0].strip().lower()
-                    # translation em fields[1], phonetic em fields[2] (não usados na chave)
-                    context = fields[3].strip().lower()
-                    carta_key = f"{word}|{context}"
-                    cartas.add(carta_key)
-                elif len(fields) >= 3:
-                    word = fields[0].strip().lower()
-                    # phonetic em fields[1] (não usado na chave)
-                    context = fields[2].strip().lower()
-                    carta_key = f"{word}|{context}"
-                    cartas.add(carta_key)
-                elif len(fields) >= 2:  # Compatibilidade com baralhos antigos
-                    word = fields[0].strip().lower()
-                    context = fields[1].strip().lower()
-                    carta_key = f"{word}|{context}"
-                    cartas.add(carta_key)
-            
-            conn.close()
-    
+        with span('carregar_existentes', modo='completo'), LeitorApkg(apkg_path) as leitor:
+            return leitor.chaves_cartas()
     except Exception as e:
-        print(f"⚠️ Erro ao ler baralho existente: {str(e)}")
-    
-    finally:
-        # Limpar diretório temporário
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir, ignore_errors=True)
-    
-    return cartas
+        logger.warning("⚠️ Erro ao ler baralho existente: %s", e)
+        return set()
 
 
-def extrair_audios_existentes(apkg_path):
+def extrair_audios_existentes(apkg_path, destino=None):
     """
     Extrai os arquivos de áudio de um .apkg existente para preservá-los no merge.
     
     Args:
         apkg_path: Caminho do arquivo .apkg
+        destino: Pasta de destino (padrão: uma pasta temporária nova, só desta chamada)
     
     Returns:
         Lista com caminhos dos arquivos de áudio extraídos
     """
-    audio_files = []
-    temp_dir = tempfile.mkdtemp()
-    
     try:
-        # Extrair o .apkg
-        with zipfile.ZipFile(apkg_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
-        
-        # Copiar arquivos de áudio (.mp3)
-        for file in os.listdir(temp_dir):
-            if file.endswith('.mp3'):
-                source = os.path.join(temp_dir, file)
-                # Copiar para diretório temporário permanente
-                dest = os.path.join(os.getcwd(), 'temp_audio_merge', file)
-                os.makedirs(os.path.dirname(dest), exist_ok=True)
-                shutil.copy2(source, dest)
-                audio_files.append(dest)
-    
+        destino = destino or tempfile.mkdtemp(prefix='temp_audio_merge_')
+        with span('extrair_midias'), LeitorApkg(apkg_path) as leitor:
+            return leitor.extrair_midias(destino)
     except Exception as e:
-        print(f"⚠️ Erro ao extrair áudios: {str(e)}")
-    
-    finally:
-        # Limpar diretório temporário de extração
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir, ignore_errors=True)
-    
-    return audio_files
+        logger.warning("⚠️ Erro ao extrair áudios: %s", e)
+        return []
 
 
 def validar_excel(file_path):
     """
-    Valida se o arquivo Excel tem o formato correto.
+    Valida se o arquivo Excel (ou CSV/Parquet) tem o formato correto.
+    
+    Só o cabeçalho e a primeira linha de dados são lidos.
     
     Args:
-        file_path: Caminho do arquivo Excel
+        file_path: Caminho do arquivo
     
     Returns:
         Tuple (bool, mensagem): True se válido, False caso contrário
     """
     try:
-        df = pd.read_excel(file_path)
+        primeiro_lote = next(ler_planilha_em_lotes(file_path, tamanho_lote=1), None)
         
-        if len(df.columns) < 2:
-            return False, "O arquivo deve ter pelo menos 2 colunas"
-        
-        if len(df) == 0:
+        if primeiro_lote is None:
             return False, "O arquivo está vazio"
         
         return True, "Arquivo válido"
         
+    except ValueError as e:
+        return False, str(e)
     except Exception as e:
         return False, f"Erro ao ler arquivo: {str(e)}"
 
 
-def limpar_arquivos_temporarios():
+def limpar_arquivos_temporarios(pasta=None):
     """
     Remove arquivos temporários criados durante o processo.
+    
+    Args:
+        pasta: Pasta onde procurar os temporários (padrão: diretório de trabalho);
+               o app passa a área de trabalho da sessão, nunca uma pasta compartilhada
     """
+    pasta = pasta or os.getcwd()
     temp_files = ['temp_excel.xlsx', 'excel_com_audios.xlsx']
     temp_dirs = ['temp_audio_merge']
     
     for temp_file in temp_files:
-        temp_path = os.path.join(os.getcwd(), temp_file)
+        temp_path = os.path.join(pasta, temp_file)
         if os.path.exists(temp_path):
             try:
                 os.remove(temp_path)
@@ -424,7 +1014,7 @@ def limpar_arquivos_temporarios():
                 pass
     
     for temp_dir in temp_dirs:
-        temp_path = os.path.join(os.getcwd(), temp_dir)
+        temp_path = os.path.join(pasta, temp_dir)
         if os.path.exists(temp_path):
             try:
                 shutil.rmtree(temp_path, ignore_errors=True)
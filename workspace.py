@@ -0,0 +1,301 @@
+import os
+import re
+import time
+import uuid
+import shutil
+import socket
+import threading
+import logging
+import tempfile
+
+from metrics import contar
+
+
+# Pasta onde ficam as áreas de trabalho das sessões
+WORKSPACES_DIR = os.environ.get('ANKI_WORKSPACES_DIR') or os.path.join(tempfile.gettempdir(), 'anki_workspaces')
+
+# Áreas de trabalho sem atividade há mais tempo que isso são removidas (segundos)
+WORKSPACE_IDADE_MAXIMA = 24 * 60 * 60
+
+# Espaço total das áreas de trabalho; acima disso as mais antigas são removidas (bytes)
+WORKSPACE_QUOTA = int(os.environ.get('ANKI_WORKSPACES_MB', 2048)) * 1024 * 1024
+
+# Áreas com atividade mais recente que isso nunca são removidas, mesmo acima da quota (segundos)
+WORKSPACE_PROTECAO = 10 * 60
+
+# Uma trava sem renovação há mais tempo que isso é considerada abandonada (segundos);
+# quem está com a trava a renova a cada terço desse tempo
+TRAVA_EXPIRACAO = 30 * 60
+
+# Nome do arquivo cujo mtime marca a última atividade da área de trabalho
+MARCADOR_ATIVIDADE = '.ativo'
+
+logger = logging.getLogger(__name__)
+
+
+class TravaArquivo:
+    """
+    Trava exclusiva entre processos baseada em um arquivo .lock.
+
+    Usa os.open com O_CREAT | O_EXCL, que é atômico em Windows, Linux e macOS
+    (inclusive entre processos diferentes, como workers do cli.py e sessões do
+    Streamlit). Enquanto a trava está com alguém, uma thread renova o mtime do
+    arquivo; uma trava sem renovação há mais que `expiracao` é de um processo
+    que morreu e é tomada.
+    """
+
+    def __init__(self, path, timeout=TRAVA_EXPIRACAO, expiracao=TRAVA_EXPIRACAO, intervalo=0.1):
+        """
+        Args:
+            path: Caminho do arquivo protegido (a trava é path + '.lock')
+            timeout: Segundos esperando a trava antes de desistir (None = para sempre);
+                     o padrão é o tempo que uma trava pode viver antes de expirar
+            expiracao: Idade (segundos) sem renovação a partir da qual uma trava é considerada abandonada
+            intervalo: Intervalo (segundos) entre tentativas
+        """
+        self.path = f"{path}.lock"
+        self.timeout = timeout
+        self.expiracao = expiracao
+        self.intervalo = intervalo
+        self.adquirida = False
+        self._identidade = None
+        self._parar_renovacao = None
+
+    def adquirir(self):
+        """
+        Bloqueia até obter a trava.
+
+        Raises:
+            TimeoutError: Se a trava não for obtida dentro do timeout
+        """
+        inicio = time.monotonic()
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self._tomar_abandonada():
+                    continue
+                if self.timeout is not None and time.monotonic() - inicio > self.timeout:
+                    raise TimeoutError(f"Arquivo em uso por outro processo: {self.path}")
+                time.sleep(self.intervalo)
+                continue
+
+            with os.fdopen(fd, 'w') as f:
+                f.write(f"{socket.gethostname()} {os.getpid()} {time.time():.0f}\n")
+            self._identidade = _identidade(os.stat(self.path))
+            self.adquirida = True
+            self._iniciar_renovacao()
+            contar('travas_adquiridas')
+            if time.monotonic() - inicio >= self.intervalo:
+                contar('travas_disputadas')
+            return
+
+    def liberar(self):
+        if self.adquirida:
+            self.adquirida = False
+            self._parar_renovacao.set()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _tomar_abandonada(self):
+        """
+        Remove a trava atual se ela estiver abandonada.
+
+        A trava é primeiro renomeada para um nome único (atômico: só um processo
+        consegue) e só então conferida: se o arquivo renomeado não é o que foi
+        julgado abandonado (outro processo já tomou a trava e criou uma nova),
+        ele é devolvido no lugar.
+
+        Returns:
+            True se a trava foi removida (tentar de novo na hora)
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            # Liberada entre a tentativa e a verificação: tentar de novo
+            return True
+        if time.time() - stat.st_mtime <= self.expiracao:
+            return False
+
+        tomada = f"{self.path}.{uuid.uuid4().hex}.abandonada"
+        try:
+            os.rename(self.path, tomada)
+        except OSError:
+            # Outro processo tomou antes
+            return True
+        if _identidade(os.stat(tomada)) != _identidade(stat):
+            # A trava renomeada é nova: devolver (se ninguém criou outra nesse meio tempo)
+            try:
+                os.link(tomada, self.path)
+            except OSError:
+                pass
+            os.remove(tomada)
+            return False
+        logger.warning("⚠️ Removendo trava abandonada: %s", self.path)
+        os.remove(tomada)
+        return True
+
+    def _iniciar_renovacao(self):
+        # Gravações longas (ex.: um baralho enorme) não podem deixar a trava parecer abandonada
+        self._parar_renovacao = parar = threading.Event()
+        identidade = self._identidade
+
+        def renovar():
+            while not parar.wait(self.expiracao / 3):
+                try:
+                    if _identidade(os.stat(self.path))[0] != identidade[0]:
+                        return
+                    os.utime(self.path)
+                except OSError:
+                    return
+
+        threading.Thread(target=renovar, name='renovar-trava', daemon=True).start()
+
+    def __enter__(self):
+        self.adquirir()
+        return self
+
+    def __exit__(self, *exc):
+        self.liberar()
+
+
+def _identidade(stat):
+    """Identifica um arquivo (dispositivo + inode, e mtime) para saber se foi trocado."""
+    return (stat.st_dev, stat.st_ino), stat.st_mtime_ns
+
+
+class Workspace:
+    """
+    Área de trabalho isolada de uma sessão (ou job): áudios, arquivos
+    temporários e extrações ficam aqui dentro, nunca em pastas compartilhadas.
+
+    A última atividade é o mtime de um arquivo marcador, atualizado por
+    tocar(); coletar_lixo remove as áreas sem atividade recente.
+    """
+
+    def __init__(self, workspace_id=None, raiz=None):
+        """
+        Args:
+            workspace_id: ID da área (padrão: um novo, aleatório)
+            raiz: Pasta das áreas de trabalho (padrão: WORKSPACES_DIR)
+        """
+        self.id = workspace_id or uuid.uuid4().hex
+        self.raiz = raiz or WORKSPACES_DIR
+        self.caminho = os.path.join(self.raiz, self.id)
+        os.makedirs(self.caminho, exist_ok=True)
+        self.tocar()
+
+    @staticmethod
+    def existe(workspace_id, raiz=None):
+        """
+        Verifica se um ID (ex.: vindo da URL) é de uma área de trabalho existente.
+
+        Args:
+            workspace_id: ID da área
+            raiz: Pasta das áreas de trabalho (padrão: WORKSPACES_DIR)
+
+        Returns:
+            True se o ID tem o formato gerado por Workspace e a pasta existe
+        """
+        if not isinstance(workspace_id, str) or not re.fullmatch(r'[0-9a-f]{32}', workspace_id):
+            return False
+        return os.path.isdir(os.path.join(raiz or WORKSPACES_DIR, workspace_id))
+
+    def pasta(self, nome):
+        """
+        Retorna (e cria) uma subpasta da área de trabalho.
+
+        Args:
+            nome: Nome da subpasta (ex.: 'audios')
+
+        Returns:
+            Caminho da subpasta
+        """
+        path = os.path.join(self.caminho, nome)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def tocar(self):
+        """Marca a área como usada agora, adiando a coleta de lixo."""
+        marcador = os.path.join(self.caminho, MARCADOR_ATIVIDADE)
+        try:
+            os.utime(marcador)
+        except FileNotFoundError:
+            open(marcador, 'a').close()
+
+    def remover(self):
+        shutil.rmtree(self.caminho, ignore_errors=True)
+
+
+def coletar_lixo(raiz=None, idade_maxima=WORKSPACE_IDADE_MAXIMA, quota=WORKSPACE_QUOTA,
+                 protecao=WORKSPACE_PROTECAO, protegidos=()):
+    """
+    Remove áreas de trabalho abandonadas.
+
+    Primeiro remove as áreas sem atividade há mais de idade_maxima; depois, se o
+    total ainda passar da quota, remove as menos recentes até caber. Áreas com
+    atividade nos últimos `protecao` segundos (ou listadas em protegidos) nunca
+    são removidas.
+
+    Args:
+        raiz: Pasta das áreas de trabalho (padrão: WORKSPACES_DIR)
+        idade_maxima: Idade máxima (segundos) sem atividade
+        quota: Tamanho máximo total (bytes)
+        protecao: Atividade recente (segundos) que impede a remoção
+        protegidos: IDs de áreas que não podem ser removidas (ex.: a da sessão atual)
+
+    Returns:
+        Número de áreas removidas
+    """
+    raiz = raiz or WORKSPACES_DIR
+    agora = time.time()
+    areas = []
+    try:
+        with os.scandir(raiz) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    try:
+                        areas.append((entry.name, entry.path, _ultima_atividade(entry.path),
+                                      _tamanho_pasta(entry.path)))
+                    except OSError:
+                        # Removida por outro processo durante a varredura
+                        continue
+    except FileNotFoundError:
+        return 0
+
+    removidas = 0
+    total = sum(tamanho for _, _, _, tamanho in areas)
+    for workspace_id, path, atividade, tamanho in sorted(areas, key=lambda area: area[2]):
+        idade = agora - atividade
+        if workspace_id in protegidos or idade < protecao:
+            continue
+        if idade <= idade_maxima and total <= quota:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= tamanho
+        removidas += 1
+
+    if removidas:
+        contar('workspaces_removidos', removidas)
+        logger.info("🧹 %d áreas de trabalho antigas removidas", removidas)
+    return removidas
+
+
+def _ultima_atividade(path):
+    try:
+        return os.path.getmtime(os.path.join(path, MARCADOR_ATIVIDADE))
+    except OSError:
+        return os.path.getmtime(path)
+
+
+def _tamanho_pasta(path):
+    total = 0
+    for diretorio, _, arquivos in os.walk(path):
+        for nome in arquivos:
+            try:
+                total += os.path.getsize(os.path.join(diretorio, nome))
+            except OSError:
+                pass
+    return total